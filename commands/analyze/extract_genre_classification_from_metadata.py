@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import click
 from loguru import logger
 
@@ -45,64 +47,60 @@ def extract_genre_classification_from_metadata(
     - Extracted from `MARC Genres` (via `book.metadata`).
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    entries_to_create = []
-    entries_to_update = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
 
     fields_to_update = [
         GenreClassification.from_metadata,
         GenreClassification.metadata_source,
     ]
 
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        genre_classification = None
-        already_exists = False
-
-        # Check if record already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
-        try:
-            # throws if not found
-            genre_classification = GenreClassification.get(book=book.barcode)
-            assert genre_classification
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
-        except Exception:
-            pass
+    for book, already_exists in utils.flag_existing_records(
+        BookIO.select(BookIO.barcode, BookIO.metadata_csv_offset)
+        .offset(offset)
+        .limit(limit)
+        .order_by(BookIO.barcode)
+        .iterator(),
+        GenreClassification,
+    ):
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} already analyzed")
+            continue
 
         # Prepare record
-        genre_classification = GenreClassification() if not already_exists else genre_classification
-        genre_classification.book = book.barcode
+        genre_classification = GenreClassification(book=book.barcode)
         genre_classification.metadata_source = "MARC Genres"
 
         from_metadata = book.metadata["MARC Genres"]
 
         if from_metadata.strip():
             genre_classification.from_metadata = from_metadata
-            logger.info(f"#{book.barcode} = {from_metadata} (metadata)")
+            logger.debug(f"#{book.barcode} = {from_metadata} (metadata)")
         else:
             logger.warning(f"#{book.barcode} - no valid genre/form info")
 
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(genre_classification)
-        else:
-            entries_to_create.append(genre_classification)
+        entries_to_upsert.append(genre_classification)
 
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
+        # Empty batch every X row
+        if len(entries_to_upsert) >= db_write_batch_size:
+            logger.info(
+                f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+            )
+            utils.process_db_upsert_batch(
                 GenreClassification,
-                entries_to_create,
-                entries_to_update,
+                entries_to_upsert,
                 fields_to_update,
             )
+            batch_start_datetime = datetime.now()
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-    # Save remaining items from batches
-    utils.process_db_write_batch(
+    utils.process_db_upsert_batch(
         GenreClassification,
-        entries_to_create,
-        entries_to_update,
+        entries_to_upsert,
         fields_to_update,
     )
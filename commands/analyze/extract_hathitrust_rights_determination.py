@@ -2,7 +2,8 @@ import os
 import re
 import traceback
 from datetime import datetime
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 import requests
@@ -12,7 +13,7 @@ from loguru import logger
 from utils import (
     needs_pipeline_ready,
     needs_hathitrust_collection_prefix,
-    get_batch_max_size,
+    map_adaptive_batches,
     process_db_write_batch,
 )
 from models import BookIO, HathitrustRightsDetermination
@@ -59,49 +60,32 @@ def extract_hathitrust_rights_determination(
     - `--max-workers` defaults to 4.
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    # Create batches of books to process
+    # Process books in batches, in parallel
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        batch = []
-
+        items = BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator()
         items_count = BookIO.select().offset(offset).limit(limit).count()
 
-        batch_max_size = get_batch_max_size(
-            items_count=items_count,
-            max_workers=max_workers,
-        )
-
-        # Create batches of items to process
-        for i, book in enumerate(
-            BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator(),
-            start=1,
-        ):
-            batch.append(book)
-
-            if len(batch) >= batch_max_size or i >= items_count:
-                future = executor.submit(process_batch, batch, overwrite)
-                futures.append(future)
-                batch = []
-
-        # Run batches in parallel
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception:
-                logger.debug(traceback.format_exc())
-
-                logger.error(
-                    "Couldn't get rights determination data from Hathitrust. Interrupting."
-                )
-
-                executor.shutdown(wait=False, cancel_futures=True)
-                exit(1)
+        try:
+            for _ in map_adaptive_batches(
+                executor,
+                partial(process_batch, overwrite=overwrite),
+                items,
+                max_workers=max_workers,
+                items_count=items_count,
+            ):
+                pass
+        except Exception:
+            logger.debug(traceback.format_exc())
+            logger.error("Couldn't get rights determination data from Hathitrust. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
 
 
 def process_batch(items: list[BookIO], overwrite=False) -> bool:
     """
     Processes a batch of BookIO entries.
     """
+    start_datetime = datetime.now()
     entries_to_create = []
     entries_to_update = []
 
@@ -137,7 +121,7 @@ def process_batch(items: list[BookIO], overwrite=False) -> bool:
             already_exists = True
 
             if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
+                logger.debug(f"#{book.barcode} already analyzed")
                 continue
         except:
             pass
@@ -215,9 +199,9 @@ def process_batch(items: list[BookIO], overwrite=False) -> bool:
             item.last_update_day = item_data["lastUpdate"][6:8]
             item.enumcron = item_data["enumcron"] if item_data["enumcron"] else None
             item.us_rights_string = item_data["usRightsString"]
-            logger.info(f"#{book.barcode} -> {item.rights_code} ({item.reason_code})")
+            logger.debug(f"#{book.barcode} -> {item.rights_code} ({item.reason_code})")
         else:
-            logger.info(f"⏭️ #{book.barcode} -> No match.")
+            logger.debug(f"⏭️ #{book.barcode} -> No match.")
 
         if not already_exists:
             entries_to_create.append(item)
@@ -227,6 +211,11 @@ def process_batch(items: list[BookIO], overwrite=False) -> bool:
     #
     # Save batches
     #
+    logger.info(
+        f"Saving {len(entries_to_create) + len(entries_to_update)} records "
+        + f"(batch of {len(items)} books processed in {datetime.now() - start_datetime})"
+    )
+
     process_db_write_batch(
         HathitrustRightsDetermination,
         entries_to_create,
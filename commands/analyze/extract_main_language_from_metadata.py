@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import click
 import iso639
 from loguru import logger
@@ -47,8 +49,8 @@ def extract_main_language_from_metadata(
     - Original data is in ISO 639-2B format. This command stores it both in this format as well as ISO 639-3.
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    entries_to_create = []
-    entries_to_update = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
 
     fields_to_update = [
         MainLanguage.from_metadata_iso639_2b,
@@ -56,56 +58,52 @@ def extract_main_language_from_metadata(
         MainLanguage.metadata_source,
     ]
 
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        main_language = None
-        already_exists = False
-
-        # Check if record already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
-        try:
-            # throws if not found
-            main_language = MainLanguage.get(book=book.barcode)
-            assert main_language
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
-        except Exception:
-            pass
+    for book, already_exists in utils.flag_existing_records(
+        BookIO.select(BookIO.barcode, BookIO.metadata_csv_offset)
+        .offset(offset)
+        .limit(limit)
+        .order_by(BookIO.barcode)
+        .iterator(),
+        MainLanguage,
+    ):
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} already analyzed")
+            continue
 
         # Prepare record
-        main_language = MainLanguage() if not already_exists else main_language
-        main_language.book = book.barcode
+        main_language = MainLanguage(book=book.barcode)
         main_language.metadata_source = "MARC Language"
 
         try:
             gxml_language = iso639.Lang(pt2b=book.metadata["MARC Language"])
             main_language.from_metadata_iso639_2b = gxml_language.pt2b
             main_language.from_metadata_iso639_3 = gxml_language.pt3
-            logger.info(f"#{book.barcode} = {gxml_language.pt3} (metadata)")
+            logger.debug(f"#{book.barcode} = {gxml_language.pt3} (metadata)")
         except Exception:
             logger.warning(f"#{book.barcode} - no valid language info.")
 
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(main_language)
-        else:
-            entries_to_create.append(main_language)
+        entries_to_upsert.append(main_language)
 
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
+        # Empty batch every X row
+        if len(entries_to_upsert) >= db_write_batch_size:
+            logger.info(
+                f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+            )
+            utils.process_db_upsert_batch(
                 MainLanguage,
-                entries_to_create,
-                entries_to_update,
+                entries_to_upsert,
                 fields_to_update,
             )
+            batch_start_datetime = datetime.now()
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-    # Save remaining items from batches
-    utils.process_db_write_batch(
+    utils.process_db_upsert_batch(
         MainLanguage,
-        entries_to_create,
-        entries_to_update,
+        entries_to_upsert,
         fields_to_update,
     )
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import click
 from loguru import logger
 
@@ -45,35 +47,28 @@ def extract_ocr_quality_from_metadata(
     - Extracted from `GRIN OCR Analysis Score` (via `book.metadata`).
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    entries_to_create = []
-    entries_to_update = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
 
     fields_to_update = [
         OCRQuality.from_metadata,
         OCRQuality.metadata_source,
     ]
 
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        ocr_quality = None
-        already_exists = False
-
-        # Check if record already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
-        try:
-            # throws if not found
-            ocr_quality = OCRQuality.get(book=book.barcode)
-            assert ocr_quality
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
-        except Exception:
-            pass
+    for book, already_exists in utils.flag_existing_records(
+        BookIO.select(BookIO.barcode, BookIO.metadata_csv_offset)
+        .offset(offset)
+        .limit(limit)
+        .order_by(BookIO.barcode)
+        .iterator(),
+        OCRQuality,
+    ):
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} already analyzed")
+            continue
 
         # Prepare record
-        ocr_quality = OCRQuality() if not already_exists else ocr_quality
-        ocr_quality.book = book.barcode
+        ocr_quality = OCRQuality(book=book.barcode)
         ocr_quality.metadata_source = "GRIN OCR Analysis Score"
 
         from_metadata = book.metadata["GRIN OCR Analysis Score"]
@@ -82,29 +77,32 @@ def extract_ocr_quality_from_metadata(
             ocr_quality.from_metadata = int(from_metadata)
             assert from_metadata is not None
             ocr_quality.from_metadata = from_metadata
-            logger.info(f"#{book.barcode} = {from_metadata} (metadata)")
+            logger.debug(f"#{book.barcode} = {from_metadata} (metadata)")
         except:
             logger.warning(f"#{book.barcode} - no valid GRIN OCR Analysis Score info")
 
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(ocr_quality)
-        else:
-            entries_to_create.append(ocr_quality)
+        entries_to_upsert.append(ocr_quality)
 
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
+        # Empty batch every X row
+        if len(entries_to_upsert) >= db_write_batch_size:
+            logger.info(
+                f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+            )
+            utils.process_db_upsert_batch(
                 OCRQuality,
-                entries_to_create,
-                entries_to_update,
+                entries_to_upsert,
                 fields_to_update,
             )
+            batch_start_datetime = datetime.now()
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-    # Save remaining items from batches
-    utils.process_db_write_batch(
+    utils.process_db_upsert_batch(
         OCRQuality,
-        entries_to_create,
-        entries_to_update,
+        entries_to_upsert,
         fields_to_update,
     )
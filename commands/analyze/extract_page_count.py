@@ -1,3 +1,9 @@
+import traceback
+import multiprocessing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import click
 from loguru import logger
 
@@ -31,12 +37,20 @@ from models import BookIO, PageCount
     default=10_000,
     help="Determines the frequency at which the database will be updated (every X entries). By default: every 10,000 entries.",
 )
+@click.option(
+    "--max-workers",
+    type=int,
+    required=False,
+    default=multiprocessing.cpu_count(),
+    help="Determines how many threads can be run in parallel.",
+)
 @utils.needs_pipeline_ready
 def extract_page_count(
     overwrite: bool,
     offset: int | None,
     limit: int | None,
     db_write_batch_size: int,
+    max_workers: int,
 ):
     """
     Extracts the page count of each book, both:
@@ -46,54 +60,94 @@ def extract_page_count(
     Notes:
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    entries_to_create = []
-    entries_to_update = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
     fields_to_update = [PageCount.count_from_ocr]
 
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        page_count = None
-        already_exists = False
+    # NOTE: Counting pages is I/O-bound (disk cache / remote storage), threads are sufficient.
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Pairs of (book, already_exists)
+        items = utils.flag_existing_records(
+            BookIO.select(BookIO.barcode, BookIO.archive_is_available)
+            .offset(offset)
+            .limit(limit)
+            .order_by(BookIO.barcode)
+            .iterator(),
+            PageCount,
+        )
+
+        items_count = BookIO.select().offset(offset).limit(limit).count()
 
-        # Check if record already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
+        #
+        # Count pages in parallel, save results from the main thread
+        #
+        # NOTE: Books are sent in batches so only a window of them is held in memory at once.
         try:
-            # throws if not found
-            page_count = PageCount.get(book=book.barcode)
-            assert page_count
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} page count already exists")
-                continue
+            for page_counts in utils.map_adaptive_batches(
+                executor,
+                partial(process_batch, overwrite=overwrite),
+                items,
+                max_workers=max_workers,
+                items_count=items_count,
+            ):
+                entries_to_upsert.extend(page_counts)
+
+                # Empty batch every X row
+                if len(entries_to_upsert) >= db_write_batch_size:
+                    logger.info(
+                        f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+                    )
+                    utils.process_db_upsert_batch(
+                        PageCount,
+                        entries_to_upsert,
+                        fields_to_update,
+                    )
+                    batch_start_datetime = datetime.now()
         except Exception:
-            pass
+            logger.debug(traceback.format_exc())
+            logger.error("Could not extract page counts. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
 
-        # Prepare record
-        page_count = PageCount() if not already_exists else page_count
-        page_count.book = book.barcode
-        page_count.count_from_ocr = len(book.text_by_page)
-
-        logger.info(f"#{book.barcode} = {page_count.count_from_ocr} pages")
-
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(page_count)
-        else:
-            entries_to_create.append(page_count)
-
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
-                PageCount,
-                entries_to_create,
-                entries_to_update,
-                fields_to_update,
-            )
-
-    # Save remaining items from batches
-    utils.process_db_write_batch(
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
+
+    utils.process_db_upsert_batch(
         PageCount,
-        entries_to_create,
-        entries_to_update,
+        entries_to_upsert,
         fields_to_update,
     )
+
+
+def process_batch(
+    items: list[tuple[BookIO, bool]],
+    overwrite: bool = False,
+) -> list[PageCount]:
+    """
+    Counts the OCR'd pages of a batch of books.
+    `items` are `(book, already_exists)` pairs, as generated by `utils.flag_existing_records()`.
+
+    Returns the records to save. Skipped books are left out.
+
+    NOTE:
+    - Records are returned to the main thread, which saves them in batches.
+    """
+    page_counts = []
+
+    for book, already_exists in items:
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} page count already exists")
+            continue
+
+        # Prepare record
+        page_count = PageCount(book=book.barcode)
+        page_count.count_from_ocr = book.ocr_page_count
+
+        logger.debug(f"#{book.barcode} = {page_count.count_from_ocr} pages")
+
+        page_counts.append(page_count)
+
+    return page_counts
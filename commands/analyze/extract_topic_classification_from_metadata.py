@@ -1,3 +1,5 @@
+from datetime import datetime
+
 import click
 from loguru import logger
 
@@ -45,64 +47,61 @@ def extract_topic_classification_from_metadata(
     - Extracted from `MARC Subjects` (via `book.metadata`).
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    entries_to_create = []
-    entries_to_update = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
 
     fields_to_update = [
         TopicClassification.from_metadata,
         TopicClassification.metadata_source,
     ]
 
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        topic_classification = None
-        already_exists = False
-
-        # Check if record already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
-        try:
-            # throws if not found
-            topic_classification = TopicClassification.get(book=book.barcode)
-            assert topic_classification
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
-        except Exception:
-            pass
+    for book, already_exists in utils.flag_existing_records(
+        BookIO.select(BookIO.barcode, BookIO.metadata_csv_offset)
+        .offset(offset)
+        .limit(limit)
+        .order_by(BookIO.barcode)
+        .iterator(),
+        TopicClassification,
+    ):
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} already analyzed")
+            continue
 
         # Prepare record
-        topic_classification = TopicClassification() if not already_exists else topic_classification
-        topic_classification.book = book.barcode
+        # NOTE: Detection-related columns of existing records are left untouched by the upsert.
+        topic_classification = TopicClassification(book=book.barcode)
         topic_classification.metadata_source = "MARC Subjects"
 
         from_metadata = book.metadata["MARC Subjects"]
 
         if from_metadata.strip():
             topic_classification.from_metadata = from_metadata
-            logger.info(f"#{book.barcode} = {from_metadata} (metadata)")
+            logger.debug(f"#{book.barcode} = {from_metadata} (metadata)")
         else:
             logger.warning(f"#{book.barcode} - no valid topic/subject info")
 
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(topic_classification)
-        else:
-            entries_to_create.append(topic_classification)
+        entries_to_upsert.append(topic_classification)
 
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
+        # Empty batch every X row
+        if len(entries_to_upsert) >= db_write_batch_size:
+            logger.info(
+                f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+            )
+            utils.process_db_upsert_batch(
                 TopicClassification,
-                entries_to_create,
-                entries_to_update,
+                entries_to_upsert,
                 fields_to_update,
             )
+            batch_start_datetime = datetime.now()
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-    # Save remaining items from batches
-    utils.process_db_write_batch(
+    utils.process_db_upsert_batch(
         TopicClassification,
-        entries_to_create,
-        entries_to_update,
+        entries_to_upsert,
         fields_to_update,
     )
@@ -1,4 +1,4 @@
-import re
+from datetime import datetime
 
 import click
 from loguru import logger
@@ -50,8 +50,8 @@ def extract_year_of_publication_from_metadata(
     - Incomplete years will be ignored (e.g: `19uu`, `1uuu`, `9999` ...).
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    entries_to_create = []
-    entries_to_update = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
 
     fields_to_update = [
         YearOfPublication.year,
@@ -60,27 +60,20 @@ def extract_year_of_publication_from_metadata(
         YearOfPublication.source_field,
     ]
 
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        year_of_publication = None
-        already_exists = False
-
-        # Check if record already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
-        try:
-            # throws if not found
-            year_of_publication = YearOfPublication.get(book=book.barcode)
-            assert year_of_publication
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
-        except Exception:
-            pass
+    for book, already_exists in utils.flag_existing_records(
+        BookIO.select(BookIO.barcode, BookIO.metadata_csv_offset)
+        .offset(offset)
+        .limit(limit)
+        .order_by(BookIO.barcode)
+        .iterator(),
+        YearOfPublication,
+    ):
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} already analyzed")
+            continue
 
         # Prepare record
-        year_of_publication = YearOfPublication() if not already_exists else year_of_publication
-        year_of_publication.book = book.barcode
+        year_of_publication = YearOfPublication(book=book.barcode)
 
         year, source_field = find_likely_publication_year(book)
 
@@ -90,30 +83,33 @@ def extract_year_of_publication_from_metadata(
         year_of_publication.source_field = source_field
 
         if year:
-            logger.info(f"#{book.barcode} was likely published in {year} ({source_field})")
+            logger.debug(f"#{book.barcode} was likely published in {year} ({source_field})")
         else:
             logger.warning(f"#{book.barcode} - no info on publication date")
 
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(year_of_publication)
-        else:
-            entries_to_create.append(year_of_publication)
+        entries_to_upsert.append(year_of_publication)
 
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
+        # Empty batch every X row
+        if len(entries_to_upsert) >= db_write_batch_size:
+            logger.info(
+                f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+            )
+            utils.process_db_upsert_batch(
                 YearOfPublication,
-                entries_to_create,
-                entries_to_update,
+                entries_to_upsert,
                 fields_to_update,
             )
+            batch_start_datetime = datetime.now()
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-    # Save remaining items from batches
-    utils.process_db_write_batch(
+    utils.process_db_upsert_batch(
         YearOfPublication,
-        entries_to_create,
-        entries_to_update,
+        entries_to_upsert,
         fields_to_update,
     )
 
@@ -128,8 +124,6 @@ def find_likely_publication_year(book: BookIO) -> tuple:
     """
     output = (None, None)
 
-    year_regex = r"^[0-9]{4}$"
-
     fields_to_check = ["MARC Date 1", "MARC Date 2"]
 
     # Do not make an assessment if:
@@ -150,10 +144,14 @@ def find_likely_publication_year(book: BookIO) -> tuple:
         if not year:
             continue
 
-        if str(year) == "9999":
+        year = str(year)
+
+        if year == "9999":
             continue
 
-        if not re.match(year_regex, str(year)):
+        # Only keep complete, 4-digit years.
+        # NOTE: Checked with str methods rather than a regex. `isascii()` rules out non-ASCII digits (e.g: "²").
+        if len(year) != 4 or not year.isascii() or not year.isdigit():
             continue
 
         year = int(year)
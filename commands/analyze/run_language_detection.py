@@ -1,11 +1,11 @@
 import traceback
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 import click
 import iso639
-import tiktoken
 from pyfranc import franc
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
@@ -75,30 +75,61 @@ def run_language_detection(
     #
     # Process books in parallel
     #
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=utils.get_tiktoken_encoding,
+        initargs=(TOKENIZER_NAME,),
+    ) as executor:
+        items_count = BookIO.select().offset(offset).limit(limit).count()
+
+        chunksize = utils.get_map_chunksize(
+            items_count=items_count,
+            max_workers=max_workers,
+        )
 
-        for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-            future = executor.submit(process_book, book, chunk_size, overwrite)
-            futures.append(future)
+        # Pairs of (book, already_exists)
+        items = utils.flag_existing_records(
+            BookIO.select(BookIO.barcode, BookIO.archive_is_available)
+            .offset(offset)
+            .limit(limit)
+            .order_by(BookIO.barcode)
+            .iterator(),
+            LanguageDetection,
+        )
 
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception:
-                logger.debug(traceback.format_exc())
-                logger.error("Could not detect languages in scanned texts. Interrupting.")
-                executor.shutdown(wait=False, cancel_futures=True)
-                exit(1)
+        batch_start_datetime = datetime.now()
+
+        try:
+            for i, _ in enumerate(
+                executor.map(
+                    partial(process_book, chunk_size=chunk_size, overwrite=overwrite),
+                    items,
+                    chunksize=chunksize,
+                ),
+                start=1,
+            ):
+                # NOTE: Records are saved by subprocesses, one book at a time: progress is summarized every `chunksize` books.
+                if i % chunksize == 0 or i == items_count:
+                    logger.info(
+                        f"{i}/{items_count} books processed "
+                        + f"(last batch processed in {datetime.now() - batch_start_datetime})"
+                    )
+                    batch_start_datetime = datetime.now()
+        except Exception:
+            logger.debug(traceback.format_exc())
+            logger.error("Could not detect languages in scanned texts. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
 
 
 def process_book(
-    book: BookIO,
+    item: tuple[BookIO, bool],
     chunk_size: int,
     overwrite: bool = False,
 ) -> bool:
     """
     Runs text-level language detection on a single book.
+    `item` is a `(book, already_exists)` pair, as generated by `utils.flag_existing_records()`.
     - Splits text in chunks roughly identified as groups of sentences of max length X
     - Runs detection on each chunk, collects main language and token count
     - Summarize language distribution at book level
@@ -106,30 +137,28 @@ def process_book(
     """
     start_datetime = datetime.now()
 
-    full_text = book.merged_text
+    book, already_exists = item
+    full_text = None
     chunks = []
 
     total_token_count = 0
     tokens_per_language = {}
 
-    tokenizer = None
     text_splitter = None
 
+    # Stop here if overwrite is `False` and we've already processed this record
+    # NOTE: Checked before loading text so skipped records don't pull OCR data from cache/storage.
+    if already_exists and not overwrite:
+        logger.debug(f"#{book.barcode} already analyzed")
+        return True
+
+    full_text = book.merged_text
+
     # Stop here if we don't have text
     if not full_text.strip():
         logger.warning(f"#{book.barcode} does not have text")
         return True
 
-    # Stop here if overwrite is `False` and we've laready processed this record
-    if (
-        not overwrite
-        and LanguageDetection.select().where(LanguageDetection.book == book.barcode).count()
-    ):
-        logger.info(f"#{book.barcode} already analyzed")
-        return True
-
-    tokenizer = tiktoken.get_encoding(TOKENIZER_NAME)
-
     #
     # Split text in chunks
     #
@@ -158,7 +187,7 @@ def process_book(
     #
     # For each chunk: count tokens, detect language
     #
-    tokenizer = tiktoken.get_encoding(TOKENIZER_NAME)
+    tokenizer = utils.get_tiktoken_encoding(TOKENIZER_NAME)
 
     for i, chunk in enumerate(chunks):
 
@@ -218,5 +247,5 @@ def process_book(
 
     # Save records
     utils.process_db_write_batch(LanguageDetection, entries_to_create, [], [])
-    logger.info(f"#{book.barcode} processed in {datetime.now() - start_datetime}")
+    logger.debug(f"#{book.barcode} processed in {datetime.now() - start_datetime}")
     return True
@@ -1,13 +1,14 @@
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 import traceback
+from datetime import datetime
 
 import click
 from ocroscope import ocr_evaluation
 from loguru import logger
 
 import utils
-from models import OCRQuality
+from models import BookIO, OCRQuality
 
 
 @click.command("run-ocr-quality-detection")
@@ -23,6 +24,13 @@ from models import OCRQuality
     required=False,
     help="If set, allows for processing a subset of the collection (sorted by BookIO.barcode).",
 )
+@click.option(
+    "--db-write-batch-size",
+    type=int,
+    required=False,
+    default=10_000,
+    help="Determines the frequency at which the database will be updated (every X entries). By default: every 10,000 entries.",
+)
 @click.option(
     "--max-workers",
     type=int,
@@ -35,6 +43,7 @@ from models import OCRQuality
 def run_ocr_quality_detection(
     offset: int | None,
     limit: int | None,
+    db_write_batch_size: int,
     max_workers: int,
 ):
     """
@@ -43,74 +52,100 @@ def run_ocr_quality_detection(
     Notes:
     - Skips entries that were already analyzed, unless instructed otherwise
     """
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
+    fields_to_update = [OCRQuality.from_detection, OCRQuality.detection_source]
+
     #
-    # Process batches of books in parallel
+    # Process books in parallel, save results from the main process
     #
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        batch = []
-
         items_count = OCRQuality.select().offset(offset).limit(limit).count()
 
-        batch_max_size = utils.get_batch_max_size(
+        chunksize = utils.get_map_chunksize(
             items_count=items_count,
             max_workers=max_workers,
         )
 
-        # Create batches of items to process
-        for i, ocr_quality in enumerate(
-            OCRQuality.select().offset(offset).limit(limit).order_by(OCRQuality.book).iterator(),
-            start=1,
-        ):
-            batch.append(ocr_quality)
-
-            if len(batch) >= batch_max_size or i >= items_count:
-                future = executor.submit(process_batch, batch)
-                futures.append(future)
-                batch = []
-
-        # Run batches in parallel
-        for future in as_completed(futures):
-            try:
-                items = future.result()
-
-                utils.process_db_write_batch(
-                    OCRQuality,
-                    [],
-                    items,
-                    [OCRQuality.from_detection, OCRQuality.detection_source],
+        # Only the columns needed to retrieve each book's text are sent to the workers
+        items = (
+            BookIO.select(BookIO.barcode, BookIO.archive_is_available)
+            .join(OCRQuality, on=(OCRQuality.book == BookIO.barcode))
+            .offset(offset)
+            .limit(limit)
+            .order_by(BookIO.barcode)
+            .iterator()
+        )
+
+        try:
+            for result in executor.map(process_book, items, chunksize=chunksize):
+                if result is None:
+                    continue
+
+                barcode, from_detection = result
+
+                entries_to_upsert.append(
+                    OCRQuality(
+                        book=barcode,
+                        from_detection=from_detection,
+                        detection_source="pleias/OCRoscope",
+                    )
                 )
 
-            except Exception:
-                logger.debug(traceback.format_exc())
-                logger.error("Could not detect OCR quality in scanned texts. Interrupting.")
-                executor.shutdown(wait=False, cancel_futures=True)
-                exit(1)
+                # Empty batch every X row
+                if len(entries_to_upsert) >= db_write_batch_size:
+                    logger.info(
+                        f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+                    )
+                    utils.process_db_upsert_batch(
+                        OCRQuality,
+                        entries_to_upsert,
+                        fields_to_update,
+                    )
+                    batch_start_datetime = datetime.now()
+        except Exception:
+            logger.debug(traceback.format_exc())
+            logger.error("Could not detect OCR quality in scanned texts. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
+
+    utils.process_db_upsert_batch(
+        OCRQuality,
+        entries_to_upsert,
+        fields_to_update,
+    )
 
 
-def process_batch(items: list[OCRQuality]) -> list[OCRQuality]:
+def process_book(book: BookIO) -> tuple[str, int] | None:
     """
-    Processes a batch of OCRQuality entries.
-    Runs OCROScope on the text of each book associated with an OCRQuality record.
+    Runs OCROScope on the text of a given book.
+    Returns a `(barcode, from_detection)` tuple, or `None` if the book could not be analyzed.
 
     NOTE:
-    - Items need to be returned to the main process before being saved in that context.
-      This is because we opened the connection fo OCRQuality items in the main process.
+    - Only the results are returned to the main process, which saves them in batches.
+      This keeps what goes through IPC down to a few bytes per book.
     """
-    for ocr_quality in items:
-        text = ocr_quality.book.merged_text
-
-        if not text.strip():
-            logger.info(f"#{ocr_quality.book.barcode} does not have text")
-            continue
-
-        try:
-            analysis = ocr_evaluation(text=text)
-            analysis.calculate_ocr_rate()
-            ocr_quality.from_detection = int(analysis.ratio_segment)
-            ocr_quality.detection_source = "pleias/OCRoscope"
-            logger.info(f"#{ocr_quality.book.barcode} = {ocr_quality.from_detection}")
-        except:
-            logger.warning(f"#{ocr_quality.book.barcode} could not be analyzed")
-
-    return items
+    text = book.merged_text
+    book.text_by_page = None  # Page-level copy of the text is no longer needed
+
+    # NOTE: `isspace()` checks for blank text without making a stripped copy of it.
+    if not text or text.isspace():
+        logger.debug(f"#{book.barcode} does not have text")
+        return None
+
+    try:
+        analysis = ocr_evaluation(text=text)
+        analysis.calculate_ocr_rate()
+        from_detection = int(analysis.ratio_segment)
+        logger.debug(f"#{book.barcode} = {from_detection}")
+    except:
+        logger.warning(f"#{book.barcode} could not be analyzed")
+        return None
+
+    return (book.barcode, from_detection)
@@ -1,6 +1,9 @@
 import traceback
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
 import click
 from simhash import Simhash
@@ -8,9 +11,10 @@ from loguru import logger
 
 from utils import (
     needs_pipeline_ready,
-    get_batch_max_size,
+    get_map_chunksize,
+    flag_existing_records,
     get_simhash_shingles,
-    process_db_write_batch,
+    process_db_upsert_batch,
 )
 from models import BookIO, ScannedTextSimhash
 from const import DEFAULT_SIMHASH_SHINGLE_WIDTH
@@ -42,6 +46,13 @@ from const import DEFAULT_SIMHASH_SHINGLE_WIDTH
     required=False,
     help="If set, allows for processing a subset of the collection (sorted by BookIO.barcode).",
 )
+@click.option(
+    "--db-write-batch-size",
+    type=int,
+    required=False,
+    default=10_000,
+    help="Determines the frequency at which the database will be updated (every X entries). By default: every 10,000 entries.",
+)
 @click.option(
     "--max-workers",
     type=int,
@@ -55,6 +66,7 @@ def run_simhash(
     overwrite: bool,
     offset: int | None,
     limit: int | None,
+    db_write_batch_size: int,
     max_workers: int,
 ):
     """
@@ -63,105 +75,111 @@ def run_simhash(
     Notes:
     - Skips entries that were already analyzed, unless instructed otherwise.
     """
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
+    fields_to_update = [ScannedTextSimhash.hash]
 
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
         items_count = BookIO.select().offset(offset).limit(limit).count()
 
-        batch_max_size = get_batch_max_size(
+        chunksize = get_map_chunksize(
             items_count=items_count,
             max_workers=max_workers,
         )
 
-        books_buffer = []
-        """ Single series of book of length batch_max_size """
-
-        #
-        # Create batches of books to process
-        #
-        for i, book in enumerate(
-            BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator(),
-            start=1,
-        ):
-            books_buffer.append(book)
-
-            # Run if buffer is full or we've reached last item
-            if len(books_buffer) >= batch_max_size or i >= items_count:
-                batch = executor.submit(
-                    process_books_batch,
-                    books_buffer,
-                    simhash_shingle_width,
-                    overwrite,
-                )
-
-                futures.append(batch)
-                books_buffer = []
+        # Pairs of (book, already_exists)
+        items = flag_existing_records(
+            BookIO.select(BookIO.barcode, BookIO.archive_is_available)
+            .offset(offset)
+            .limit(limit)
+            .order_by(BookIO.barcode)
+            .iterator(),
+            ScannedTextSimhash,
+        )
 
         #
-        # Analyze batches in parallel
+        # Analyze books in parallel, save results from the main process
         #
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception:
-                logger.debug(traceback.format_exc())
-                logger.error("Could not run simhash on OCR'd texts. Interrupting.")
-                executor.shutdown(wait=False, cancel_futures=True)
-                exit(1)
-
-
-def process_books_batch(
-    books: list[BookIO],
-    simhash_shingle_width: int = DEFAULT_SIMHASH_SHINGLE_WIDTH,
-    overwrite: bool = False,
-) -> bool:
-    """
-    Generates simhashes for a set of books and saves them.
-    """
-    entries_to_create = []
-    entries_to_update = []
-
-    for book in books:
-        scanned_text_simhash = None
-        already_exists = False
-        merged_text = None
-
-        # Check if record already exists
         try:
-            # throws if not found
-            scanned_text_simhash = ScannedTextSimhash.get(book=book.barcode)
-            assert scanned_text_simhash
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
+            for scanned_text_simhash in executor.map(
+                partial(
+                    process_book,
+                    simhash_shingle_width=simhash_shingle_width,
+                    overwrite=overwrite,
+                ),
+                items,
+                chunksize=chunksize,
+            ):
+                if scanned_text_simhash is None:
+                    continue
+
+                entries_to_upsert.append(scanned_text_simhash)
+
+                # Empty batch every X row
+                if len(entries_to_upsert) >= db_write_batch_size:
+                    logger.info(
+                        f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+                    )
+                    process_db_upsert_batch(
+                        ScannedTextSimhash,
+                        entries_to_upsert,
+                        fields_to_update,
+                    )
+                    batch_start_datetime = datetime.now()
         except Exception:
-            pass
+            logger.debug(traceback.format_exc())
+            logger.error("Could not run simhash on OCR'd texts. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-        # Prepare record
-        scanned_text_simhash = ScannedTextSimhash() if not already_exists else scanned_text_simhash
-        scanned_text_simhash.book = book.barcode
+    process_db_upsert_batch(
+        ScannedTextSimhash,
+        entries_to_upsert,
+        fields_to_update,
+    )
 
-        merged_text = book.merged_text
 
-        if merged_text.strip():
-            hash = Simhash(get_simhash_shingles(merged_text, simhash_shingle_width))
-            scanned_text_simhash.hash = hash.value
-            logger.info(f"#{book.barcode} = {hash.value}")
-        else:
-            logger.warning(f"#{book.barcode} does not have text")
+def process_book(
+    item: tuple[BookIO, bool],
+    simhash_shingle_width: int = DEFAULT_SIMHASH_SHINGLE_WIDTH,
+    overwrite: bool = False,
+) -> ScannedTextSimhash | None:
+    """
+    Generates a simhash for a single book.
+    `item` is a `(book, already_exists)` pair, as generated by `utils.flag_existing_records()`.
 
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(scanned_text_simhash)
-        else:
-            entries_to_create.append(scanned_text_simhash)
+    Returns the record to save, or `None` if the book was skipped.
 
-    # Save batches
-    process_db_write_batch(
-        ScannedTextSimhash,
-        entries_to_create,
-        entries_to_update,
-        [ScannedTextSimhash.hash],
-    )
+    NOTE:
+    - Records are returned to the main process, which saves them in batches.
+    """
+    book, already_exists = item
+    merged_text = None
+
+    if already_exists and not overwrite:
+        logger.debug(f"#{book.barcode} already analyzed")
+        return None
+
+    # Prepare record
+    scanned_text_simhash = ScannedTextSimhash(book=book.barcode)
+
+    merged_text = book.merged_text
+    book.text_by_page = None  # Page-level copy of the text is no longer needed
+
+    # NOTE: `isspace()` checks for blank text without making a stripped copy of it.
+    if merged_text and not merged_text.isspace():
+        # NOTE: Shingles are passed as a {shingle: weight} dict so each unique shingle is only hashed once.
+        # A weight of N is equivalent to passing the same shingle N times: the resulting hash is unchanged.
+        hash = Simhash(Counter(get_simhash_shingles(merged_text, simhash_shingle_width)))
+        scanned_text_simhash.hash = hash.value
+        logger.debug(f"#{book.barcode} = {hash.value}")
+    else:
+        logger.warning(f"#{book.barcode} does not have text")
+
+    return scanned_text_simhash
@@ -1,24 +1,36 @@
 import traceback
 import multiprocessing
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial, lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from collections import Counter
 from datetime import datetime
 
 import click
 import iso639
+import peewee
 
 import polyglot
 import polyglot.text
-import tiktoken
 from loguru import logger
 
 import utils
-from utils import get_batch_max_size, process_db_write_batch
-from models import BookIO, TextAnalysis, OCRPostProcessingTextAnalysis
+from utils import (
+    get_map_chunksize,
+    get_tiktoken_encoding,
+    flag_existing_records,
+    process_db_upsert_batch,
+)
+from models import BookIO, MainLanguage, TextAnalysis, OCRPostProcessingTextAnalysis
 
 TOKENIZER_NAME = "o200k_base"
 """ Target tokenizer to be used with tiktoken """
 
+NON_CONTINUOUS_CHARS = (" ", "\n", "\t", "\u200b", "-", "—")
+""" Characters excluded from `char_count_continous`. """
+
+POLYGLOT_INPUT_TRANSLATION_TABLE = str.maketrans("", "", "\u200b\n")
+""" Translation table removing zero-width spaces and line breaks from the text passed to polyglot. """
+
 
 @click.command("run-text-analysis")
 @click.option(
@@ -39,6 +51,13 @@ TOKENIZER_NAME = "o200k_base"
     required=False,
     help="If set, allows for processing a subset of the collection (sorted by BookIO.barcode).",
 )
+@click.option(
+    "--db-write-batch-size",
+    type=int,
+    required=False,
+    default=10_000,
+    help="Determines the frequency at which the database will be updated (every X entries). By default: every 10,000 entries.",
+)
 @click.option(
     "--max-workers",
     type=int,
@@ -58,6 +77,7 @@ def run_text_analysis(
     overwrite: bool,
     offset: int | None,
     limit: int | None,
+    db_write_batch_size: int,
     max_workers: int,
     use_postprocessed_ocr: bool,
 ):
@@ -72,248 +92,307 @@ def run_text_analysis(
     Notes:
     - Skips entries that were already analyzed, unless instructed otherwise
     """
+    model = TextAnalysis if not use_postprocessed_ocr else OCRPostProcessingTextAnalysis
+
+    entries_to_upsert = []
+    batch_start_datetime = datetime.now()
+    fields_to_update = get_fields_to_update(model)
+
     #
-    # Process books in batches
+    # Analyze books in parallel, save results from the main process
     #
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=get_tiktoken_encoding,
+        initargs=(TOKENIZER_NAME,),
+    ) as executor:
         items_count = BookIO.select().offset(offset).limit(limit).count()
 
-        batch_max_size = get_batch_max_size(
+        chunksize = get_map_chunksize(
             items_count=items_count,
             max_workers=max_workers,
         )
 
-        books_buffer = []
-        """ Single series of book of length batch_max_size """
+        # Pairs of (book, already_exists)
+        # NOTE: Books that were already analyzed are filtered out here, so they are never sent to subprocesses.
+        # NOTE: Language codes are joined in, so workers don't need to query MainLanguage for each book.
+        items = (
+            (book, already_exists)
+            for book, already_exists in flag_existing_records(
+                BookIO.select(
+                    BookIO.barcode,
+                    BookIO.archive_is_available,
+                    MainLanguage.from_detection_iso639_3,
+                    MainLanguage.from_metadata_iso639_2b,
+                )
+                .join(
+                    MainLanguage,
+                    peewee.JOIN.LEFT_OUTER,
+                    on=(MainLanguage.book == BookIO.barcode),
+                    attr="main_language",
+                )
+                .offset(offset)
+                .limit(limit)
+                .order_by(BookIO.barcode)
+                .iterator(),
+                model,
+            )
+            if overwrite or not already_exists
+        )
 
-        #
-        # Create batches of books to process
-        #
-        for i, book in enumerate(
-            BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator(),
-            start=1,
-        ):
-            books_buffer.append(book)
+        try:
+            for text_analysis in executor.map(
+                partial(
+                    process_book,
+                    overwrite=overwrite,
+                    use_postprocessed_ocr=use_postprocessed_ocr,
+                ),
+                items,
+                chunksize=chunksize,
+            ):
+                if text_analysis is None:
+                    continue
+
+                entries_to_upsert.append(text_analysis)
+
+                # Empty batch every X row
+                if len(entries_to_upsert) >= db_write_batch_size:
+                    logger.info(
+                        f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+                    )
+                    process_db_upsert_batch(
+                        model,
+                        entries_to_upsert,
+                        fields_to_update,
+                    )
+                    batch_start_datetime = datetime.now()
+        except Exception:
+            logger.debug(traceback.format_exc())
+            logger.error("Could not run text analysis on OCR'd texts. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
+
+    # Save remaining items from batch
+    if entries_to_upsert:
+        logger.info(
+            f"Saving {len(entries_to_upsert)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
 
-            # Run if buffer is full or we've reached last item
-            if len(books_buffer) >= batch_max_size or i >= items_count:
-                batch = executor.submit(
-                    process_books_batch, books_buffer, overwrite, use_postprocessed_ocr
-                )
-                futures.append(batch)
-                books_buffer = []
+    process_db_upsert_batch(
+        model,
+        entries_to_upsert,
+        fields_to_update,
+    )
 
-        #
-        # Analyze batches in parallel
-        #
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception:
-                logger.debug(traceback.format_exc())
-                logger.error("Could not run text analysis on OCR'd texts. Interrupting.")
-                executor.shutdown(wait=False, cancel_futures=True)
-                exit(1)
-
-
-def process_books_batch(
-    books: list[BookIO],
+
+def process_book(
+    item: tuple[BookIO, bool],
     overwrite: bool = False,
     use_postprocessed_ocr: bool = False,
-) -> tuple:
-    """
-    Generates text analysis metrics for a set of books and saves them.
+) -> TextAnalysis | OCRPostProcessingTextAnalysis | None:
     """
-    tokenizer = tiktoken.get_encoding(TOKENIZER_NAME)
-    entries_to_create = []
-    entries_to_update = []
+    Generates text analysis metrics for a single book.
+    `item` is a `(book, already_exists)` pair, as generated by `utils.flag_existing_records()`.
 
+    Returns the record to save, or `None` if the book was skipped.
+
+    NOTE:
+    - Records are returned to the main process, which saves them in batches.
+    """
+    tokenizer = get_tiktoken_encoding(TOKENIZER_NAME)
     model = TextAnalysis if not use_postprocessed_ocr else OCRPostProcessingTextAnalysis
 
-    for book in books:
-        start_datetime = datetime.now()
-        text_analysis = None
-        already_exists = False
-        merged_text = None
+    book, already_exists = item
+    start_datetime = datetime.now()
+    text_analysis = None
+    merged_text = None
+
+    if already_exists and not overwrite:
+        logger.debug(f"#{book.barcode} already analyzed")
+        return None
 
+    #
+    # Prepare record, analyze merged text
+    #
+    text_analysis = model(book=book.barcode)
+
+    text_analysis.char_count = 0
+    text_analysis.char_count_continous = 0
+
+    try:
+        if not use_postprocessed_ocr:
+            merged_text = book.merged_text
+            book.text_by_page = None  # Page-level copy of the text is no longer needed
+        else:
+            merged_text = "\n".join(book.postprocessed_ocr["text_by_page"])
+    except:
+        merged_text = ""
+
+    # We will create an empty record if no text is available.
+    # NOTE: `isspace()` checks for blank text without making a stripped copy of it.
+    if not merged_text or merged_text.isspace():
+        logger.warning(f"#{book.barcode} does not have text")
+    else:
         #
-        # Check if record already exists
+        # Split text into words/sentences/n-grams
         #
-        try:
-            text_analysis = model.get(book=book.barcode)  # throws if not found
-            assert text_analysis
-            already_exists = True
 
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} already analyzed")
-                continue
-        except Exception:
-            pass
+        # Get language code hint
+        # NOTE: MainLanguage fields are joined in by the main process (`book.main_language`).
+        main_language = getattr(book, "main_language", None)
+        language_code = None
+
+        # ... from metadata if detection did not yield a code, default to "en" otherwise
+        # NOTE: A code obtained from detection is not passed on as a hint, and falls back to "en".
+        # This matches the behavior existing records were computed with: changing it would alter tokenization.
+        if main_language is not None and not get_iso639_1_code(
+            pt3=main_language.from_detection_iso639_3
+        ):
+            language_code = get_iso639_1_code(pt2b=main_language.from_metadata_iso639_2b)
+
+        if not language_code:
+            language_code = "en"
+
+        # NOTE: The decision to remove \u200b in that context was made after initial rounds of testing.
+        # This decision should be revisited.
+        nlp_text = polyglot.text.Text(
+            merged_text.translate(POLYGLOT_INPUT_TRANSLATION_TABLE),
+            hint_language_code=language_code,
+        )
+
+        # NOTE: polyglot's `Word` is a `str` subclass: it can be lowercased directly, without an intermediate `str()` copy.
+        words = [word.lower() for word in nlp_text.words]
+        sentences = []
+        sentences_char_count = 0
+
+        # NOTE: Sentence lengths are accumulated while building the list of lowercased sentences.
+        for sentence in nlp_text.sentences:
+            sentence = str(sentence)
+            sentences_char_count += len(sentence)
+            sentences.append(sentence.lower())
 
         #
-        # Prepare record, analyze merged text
+        # Compute: fragment counts (total/unique) and type token ratios
         #
-        text_analysis = model() if not already_exists else text_analysis
+        # NOTE: N-grams are counted as tuples of words, without being joined into strings first.
+        words_counter = Counter(words)
+        bigrams_counter = Counter(zip(words, words[1:]))
+        trigrams_counter = Counter(zip(words, words[1:], words[2:]))
+        sentences_counter = Counter(sentences)
+
+        bigrams_count = max(len(words) - 1, 0)
+        trigrams_count = max(len(words) - 2, 0)
+
+        if len(words):
+            text_analysis.word_type_token_ratio = len(words_counter) / len(words) * 100
+            text_analysis.word_count = len(words)
+            text_analysis.word_count_unique = len(words_counter)
+
+        if bigrams_count:
+            text_analysis.bigram_type_token_ratio = len(bigrams_counter) / bigrams_count * 100
+            text_analysis.bigram_count = bigrams_count
+            text_analysis.bigram_count_unique = len(bigrams_counter)
+        del bigrams_counter
+
+        if trigrams_count:
+            text_analysis.trigram_type_token_ratio = len(trigrams_counter) / trigrams_count * 100
+            text_analysis.trigram_count = trigrams_count
+            text_analysis.trigram_count_unique = len(trigrams_counter)
+        del trigrams_counter
+
+        if len(sentences):
+            sentence_type_token_ratio = len(sentences_counter) / len(sentences) * 100
+            text_analysis.sentence_type_token_ratio = sentence_type_token_ratio
+
+            text_analysis.sentence_count = len(sentences)
+            text_analysis.sentence_count_unique = len(sentences_counter)
+        del sentences_counter
 
-        text_analysis.book = book.barcode
-        text_analysis.char_count = 0
-        text_analysis.char_count_continous = 0
+        #
+        # Compute average sentence length
+        #
+        if len(sentences):
+            text_analysis.sentence_average_length = sentences_char_count / len(sentences)
 
-        try:
-            if not use_postprocessed_ocr:
-                merged_text = book.merged_text
-            else:
-                merged_text = "\n".join(book.postprocessed_ocr["text_by_page"])
-        except:
-            merged_text = ""
-
-        # We will create an empty record if no text is available.
-        if not merged_text.strip():
-            logger.warning(f"#{book.barcode} does not have text")
-        else:
-            #
-            # Split text into words/sentences/n-grams
-            #
-
-            # Get language code hint
-            language_code = None
-
-            # ... from detection if available
-            try:
-                language_code = book.mainlanguage_set[0].from_detection_iso639_3
-                language_code = iso639.Lang(pt3=language_code).pt1
-                assert language_code
-            except:
-                language_code = None
-
-            # ... from metadata otherwise, default to "en" if none is available
-            try:
-                assert language_code is None
-                language_code = book.mainlanguage_set[0].from_metadata_iso639_2b
-                language_code = iso639.Lang(pt2b=language_code).pt1
-                assert language_code
-            except:
-                language_code = "en"
-
-            # NOTE: The decision to remove \u200b in that context was made after initial rounds of testing.
-            # This decision should be revisited.
-            nlp_text = polyglot.text.Text(
-                merged_text.replace("\u200b", "").replace("\n", ""),
-                hint_language_code=language_code,
-            )
+        #
+        # Compute char counts
+        #
+        text_analysis.char_count = len(merged_text)
 
-            words = [str(word).lower() for word in nlp_text.words]
-            sentences = [str(sentence).lower() for sentence in nlp_text.sentences]
-            bigrams = [" ".join(words[i : i + 2]).lower() for i in range(0, len(words) - 1)]
-            trigrams = [" ".join(words[i : i + 3]).lower() for i in range(0, len(words) - 2)]
-
-            #
-            # Compute: fragment counts (total/unique) and type token ratios
-            #
-            words_counter = Counter(words)
-            bigrams_counter = Counter(bigrams)
-            trigrams_counter = Counter(trigrams)
-            sentences_counter = Counter(sentences)
-
-            if len(words):
-                text_analysis.word_type_token_ratio = len(words_counter) / len(words) * 100
-                text_analysis.word_count = len(words)
-                text_analysis.word_count_unique = len(words_counter)
-            del words_counter
-
-            if len(bigrams):
-                text_analysis.bigram_type_token_ratio = len(bigrams_counter) / len(bigrams) * 100
-                text_analysis.bigram_count = len(bigrams)
-                text_analysis.bigram_count_unique = len(bigrams_counter)
-            del bigrams_counter
-
-            if len(trigrams):
-                text_analysis.trigram_type_token_ratio = len(trigrams_counter) / len(trigrams) * 100
-                text_analysis.trigram_count = len(trigrams)
-                text_analysis.trigram_count_unique = len(trigrams_counter)
-            del trigrams_counter
-
-            if len(sentences):
-                sentence_type_token_ratio = len(sentences_counter) / len(sentences) * 100
-                text_analysis.sentence_type_token_ratio = sentence_type_token_ratio
-
-                text_analysis.sentence_count = len(sentences)
-                text_analysis.sentence_count_unique = len(sentences_counter)
-            del sentences_counter
-
-            #
-            # Compute average sentence length
-            #
-            if len(sentences):
-                sentences_char_count = sum([len(sentence) for sentence in sentences])
-                text_analysis.sentence_average_length = sentences_char_count / len(sentences)
-
-            #
-            # Compute char counts
-            #
-            text_analysis.char_count = len(merged_text)
-
-            text_analysis.char_count_continous = len(
-                merged_text.replace(" ", "")
-                .replace("\n", "")
-                .replace("\t", "")
-                .replace("\u200b", "")
-                .replace("-", "")
-                .replace("—", "")
+        # NOTE: Excluded characters are counted rather than stripped out, to avoid copying the text.
+        text_analysis.char_count_continous = len(merged_text) - sum(
+            merged_text.count(char) for char in NON_CONTINUOUS_CHARS
+        )
+
+        #
+        # Compute "tokenizability" (how "well" the words in this text tokenize)
+        #
+        # NOTE: Each unique word is only encoded once, then weighted by its number of occurrences.
+        # `num_threads=1`: parallelism is already handled at process level.
+        total_word_tokens = 0
+
+        unique_words = list(words_counter.keys())
+        tokens_per_word = tokenizer.encode_ordinary_batch(unique_words, num_threads=1)
+
+        for word, tokens in zip(unique_words, tokens_per_word):
+            total_word_tokens += len(tokens) * words_counter[word]
+
+        del words_counter
+
+        if total_word_tokens:
+            text_analysis.tokenizability_o200k_base_ratio = (
+                len(words) * 1.25 / total_word_tokens * 100
             )
 
-            #
-            # Compute "tokenizability" (how "well" the words in this text tokenize)
-            #
-            total_word_tokens = 0
+        # NOTE: Score may exceed 100 because of our 1 token = 1.25 word target
+        if text_analysis.tokenizability_o200k_base_ratio > 100.0:
+            text_analysis.tokenizability_o200k_base_ratio = 100.0
 
-            for word in words:
-                total_word_tokens += len(tokenizer.encode(word))
+        logger.debug(f"#{book.barcode} processed in {datetime.now() - start_datetime}")
 
-            if total_word_tokens:
-                text_analysis.tokenizability_o200k_base_ratio = (
-                    len(words) * 1.25 / total_word_tokens * 100
-                )
+    return text_analysis
 
-            # NOTE: Score may exceed 100 because of our 1 token = 1.25 word target
-            if text_analysis.tokenizability_o200k_base_ratio > 100.0:
-                text_analysis.tokenizability_o200k_base_ratio = 100.0
 
-            logger.info(f"#{book.barcode} processed in {datetime.now() - start_datetime}")
+@lru_cache(maxsize=None)
+def get_iso639_1_code(pt3: str | None = None, pt2b: str | None = None) -> str | None:
+    """
+    Converts an ISO 639-3 or ISO 639-2b language code into its ISO 639-1 equivalent.
+    Returns `None` if no code was provided, or if it has no ISO 639-1 equivalent.
+    Memoized, since the same handful of codes come up for most books.
+    """
+    if not pt3 and not pt2b:
+        return None
 
-        #
-        # Add to batch
-        #
-        if already_exists:
-            entries_to_update.append(text_analysis)
-        else:
-            entries_to_create.append(text_analysis)
+    try:
+        if pt3:
+            return iso639.Lang(pt3=pt3).pt1 or None
 
-    #
-    # Save batches
-    #
-    process_db_write_batch(
-        model,
-        entries_to_create,
-        entries_to_update,
-        [
-            model.char_count,
-            model.char_count_continous,
-            model.word_count,
-            model.word_count_unique,
-            model.word_type_token_ratio,
-            model.bigram_count,
-            model.bigram_count_unique,
-            model.bigram_type_token_ratio,
-            model.trigram_count,
-            model.trigram_count_unique,
-            model.trigram_type_token_ratio,
-            model.sentence_count,
-            model.sentence_count_unique,
-            model.sentence_type_token_ratio,
-            model.sentence_average_length,
-            model.tokenizability_o200k_base_ratio,
-        ],
-    )
+        return iso639.Lang(pt2b=pt2b).pt1 or None
+    except Exception:
+        return None
+
+
+def get_fields_to_update(
+    model: type[TextAnalysis] | type[OCRPostProcessingTextAnalysis],
+) -> list:
+    """
+    Returns the list of fields to update on existing `model` records.
+    """
+    return [
+        model.char_count,
+        model.char_count_continous,
+        model.word_count,
+        model.word_count_unique,
+        model.word_type_token_ratio,
+        model.bigram_count,
+        model.bigram_count_unique,
+        model.bigram_type_token_ratio,
+        model.trigram_count,
+        model.trigram_count_unique,
+        model.trigram_type_token_ratio,
+        model.sentence_count,
+        model.sentence_count_unique,
+        model.sentence_type_token_ratio,
+        model.sentence_average_length,
+        model.tokenizability_o200k_base_ratio,
+    ]
@@ -1,8 +1,13 @@
 import os
 import traceback
 import multiprocessing
+from collections import Counter
+from functools import partial, lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 
 import click
+import peewee
 import tiktoken
 from loguru import logger
 
@@ -19,8 +24,9 @@ from models import BookIO, TokenCount
 )
 @click.option(
     "--tokenizer-threads",
-    default=multiprocessing.cpu_count(),
+    default=1,
     type=int,
+    help="Number of threads each worker's tokenizer can use. By default: 1, as books are already processed in parallel.",
 )
 @click.option(
     "--overwrite",
@@ -47,6 +53,13 @@ from models import BookIO, TokenCount
     default=10_000,
     help="Determines the frequency at which the database will be updated (every X entries). By default: every 10,000 entries.",
 )
+@click.option(
+    "--max-workers",
+    type=int,
+    required=False,
+    default=multiprocessing.cpu_count(),
+    help="Determines how many subprocesses can be run in parallel.",
+)
 @utils.needs_pipeline_ready
 def run_token_count(
     target_llm: str,
@@ -55,6 +68,7 @@ def run_token_count(
     offset: int | None,
     limit: int | None,
     db_write_batch_size: int,
+    max_workers: int,
 ):
     """
     Tokenizes the OCR'd text of each entry and saves the resulting token counts in the database.
@@ -65,29 +79,23 @@ def run_token_count(
     - Skips texts that were already analyzed with this specific tokenizer, unless instructed otherwise.
     - A valid HuggingFace token might be needed to access some of the target tokenizers.
     """
-    tokenizer = None
     tokenizer_name = ""
 
     entries_to_update = []
     entries_to_create = []
+    batch_start_datetime = datetime.now()
     fields_to_update = [TokenCount.count]
 
-    # Configure HF AutoTokenizer's parallelisim before importing it
-    os.environ["TOKENIZERS_PARALLELISM"] = "true"
+    # Configure HF AutoTokenizer's parallelisim before it gets imported.
+    # NOTE: Books are processed in parallel, one tokenizer per subprocess: threads per tokenizer are kept low to avoid oversubscription.
+    os.environ["TOKENIZERS_PARALLELISM"] = "true" if tokenizer_threads > 1 else "false"
     os.environ["RAYON_NUM_THREADS"] = str(tokenizer_threads)
 
-    from transformers import AutoTokenizer
-
     #
     # Try to load tokenizer based on model_name
     #
     try:
-        if "openai/" in target_llm:
-            tokenizer = tiktoken.encoding_for_model(target_llm.replace("openai/", ""))
-            tokenizer_name = tokenizer.name
-        else:
-            tokenizer = AutoTokenizer.from_pretrained(target_llm)
-            tokenizer_name = tokenizer.name_or_path
+        tokenizer_name = get_tokenizer_name(target_llm)
     except Exception:
         logger.debug(traceback.format_exc())
         logger.error(f"Could not load tokenizer for model {target_llm}. Interrupting.")
@@ -98,70 +106,192 @@ def run_token_count(
     #
     # Count token for each record
     #
-    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
-        token_count = None
-        already_exists = False
-        text_by_page = book.text_by_page
-        total = 0
+    # Pairs of (book, already_exists)
+    items = utils.flag_existing_records(
+        BookIO.select(BookIO.barcode, BookIO.archive_is_available)
+        .offset(offset)
+        .limit(limit)
+        .order_by(BookIO.barcode)
+        .iterator(),
+        TokenCount,
+        condition=(TokenCount.tokenizer == tokenizer_name),
+    )
 
-        # Check if token count already exists
-        # NOTE: That check is done on the fly so this process can be easily parallelized.
+    items_count = BookIO.select().offset(offset).limit(limit).count()
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=get_tokenizer,
+        initargs=(target_llm,),
+    ) as executor:
         try:
-            # throws if not found
-            token_count = TokenCount.get(book=book.barcode, tokenizer=tokenizer_name)
-            assert token_count
-            already_exists = True
-
-            if already_exists and not overwrite:
-                logger.info(f"#{book.barcode} {tokenizer_name} already exists")
-                continue
-        except Exception:
-            pass
+            for counts in utils.map_adaptive_batches(
+                executor,
+                partial(
+                    process_batch,
+                    target_llm=target_llm,
+                    overwrite=overwrite,
+                    tokenizer_threads=tokenizer_threads,
+                ),
+                items,
+                max_workers=max_workers,
+                items_count=items_count,
+            ):
+                # Existing records are only retrieved when they need to be overwritten, all at once for this batch
+                existing_records = get_existing_records(
+                    [barcode for barcode, already_exists, _ in counts if already_exists],
+                    tokenizer_name,
+                )
 
-        # Only run tokenizer if text is not empty
-        if book.merged_text.strip():
-            # Tiktoken (GPT-X)
-            if target_llm.startswith("openai"):
-                token_batches = tokenizer.encode_batch(text_by_page, num_threads=tokenizer_threads)
+                for barcode, _, total in counts:
+                    already_exists = barcode in existing_records
+                    token_count = existing_records[barcode] if already_exists else TokenCount()
 
-                for tokens in token_batches:
-                    total += len(tokens)
+                    # Prepare record
+                    token_count.book = barcode
+                    token_count.target_llm = target_llm
+                    token_count.tokenizer = tokenizer_name
+                    token_count.count = total
 
-            # Transformers (other)
-            else:
-                token_batches = tokenizer.batch_encode_plus(text_by_page)
-
-                for tokens in token_batches["input_ids"]:
-                    total += len(tokens)
-
-        # Prepare record
-        token_count = TokenCount() if not already_exists else token_count
-        token_count.book = book.barcode
-        token_count.target_llm = target_llm
-        token_count.tokenizer = tokenizer_name
-        token_count.count = total
-
-        logger.info(f"#{book.barcode} + {tokenizer_name} = {total} tokens")
-
-        # Add to batch
-        if already_exists:
-            entries_to_update.append(token_count)
-        else:
-            entries_to_create.append(token_count)
-
-        # Empty batches every X row
-        if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
-            utils.process_db_write_batch(
-                TokenCount,
-                entries_to_create,
-                entries_to_update,
-                fields_to_update,
-            )
+                    logger.debug(f"#{barcode} + {tokenizer_name} = {total} tokens")
+
+                    # Add to batch
+                    if already_exists:
+                        entries_to_update.append(token_count)
+                    else:
+                        entries_to_create.append(token_count)
+
+                # Empty batches every X row
+                if len(entries_to_create) + len(entries_to_update) >= db_write_batch_size:
+                    logger.info(
+                        f"Saving {len(entries_to_create) + len(entries_to_update)} records (batch processed in {datetime.now() - batch_start_datetime})"
+                    )
+                    utils.process_db_write_batch(
+                        TokenCount,
+                        entries_to_create,
+                        entries_to_update,
+                        fields_to_update,
+                    )
+                    batch_start_datetime = datetime.now()
+        except Exception:
+            logger.debug(traceback.format_exc())
+            logger.error("Could not count tokens. Interrupting.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            exit(1)
 
     # Save remaining items from batches
+    if entries_to_create or entries_to_update:
+        logger.info(
+            f"Saving {len(entries_to_create) + len(entries_to_update)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
+
     utils.process_db_write_batch(
         TokenCount,
         entries_to_create,
         entries_to_update,
         fields_to_update,
     )
+
+
+def get_existing_records(barcodes: list[str], tokenizer_name: str) -> dict[str, TokenCount]:
+    """
+    Retrieves existing TokenCount records for `barcodes` and `tokenizer_name`, indexed by barcode.
+    Runs one `WHERE book IN (...)` query per group of 999 barcodes.
+    """
+    existing_records = {}
+
+    for barcodes_batch in peewee.chunked(barcodes, 999):
+        for token_count in TokenCount.select().where(
+            TokenCount.book.in_(barcodes_batch),
+            TokenCount.tokenizer == tokenizer_name,
+        ):
+            existing_records[token_count.book_id] = token_count
+
+    return existing_records
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(target_llm: str):
+    """
+    Loads the tokenizer of `target_llm`, once per process.
+    Models prefixed with `openai/` are handled by tiktoken, others by HF's AutoTokenizer.
+    """
+    if "openai/" in target_llm:
+        return tiktoken.encoding_for_model(target_llm.replace("openai/", ""))
+
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(target_llm)
+
+
+def get_tokenizer_name(target_llm: str) -> str:
+    """
+    Returns the name of the tokenizer of `target_llm`, as stored in `TokenCount.tokenizer`.
+    """
+    tokenizer = get_tokenizer(target_llm)
+
+    if "openai/" in target_llm:
+        return tokenizer.name
+
+    return tokenizer.name_or_path
+
+
+def process_batch(
+    items: list[tuple[BookIO, bool]],
+    target_llm: str,
+    overwrite: bool = False,
+    tokenizer_threads: int = 1,
+) -> list[tuple[str, bool, int]]:
+    """
+    Tokenizes the OCR'd text of a batch of books.
+    `items` are `(book, already_exists)` pairs, as generated by `utils.flag_existing_records()`.
+
+    Returns `(barcode, already_exists, token_count)` tuples. Skipped books are left out.
+
+    NOTE:
+    - Counts are returned to the main process, which saves them in batches.
+    """
+    tokenizer = get_tokenizer(target_llm)
+    tokenizer_name = get_tokenizer_name(target_llm)
+    counts = []
+
+    for book, already_exists in items:
+        if already_exists and not overwrite:
+            logger.debug(f"#{book.barcode} {tokenizer_name} already exists")
+            continue
+
+        # NOTE: Text is loaded after the check above so skipped records don't pull OCR data from cache/storage.
+        text_by_page = book.text_by_page
+        total = 0
+
+        # Only run tokenizer if text is not empty
+        # NOTE: Checked page by page, rather than by building and stripping a merged copy of the text.
+        if any(page and not page.isspace() for page in text_by_page):
+            # Identical pages (blank pages, repeated headers ...) are only tokenized once
+            page_occurrences = Counter(text_by_page)
+            unique_pages = list(page_occurrences.keys())
+
+            # Tiktoken (GPT-X)
+            # NOTE: `encode_ordinary_batch` treats special tokens found in the text as plain text, instead of raising.
+            if target_llm.startswith("openai"):
+                token_counts = map(
+                    len,
+                    tokenizer.encode_ordinary_batch(unique_pages, num_threads=tokenizer_threads),
+                )
+
+            # Transformers (other)
+            # NOTE: Only lengths are requested back, not attention masks.
+            else:
+                token_counts = tokenizer(
+                    unique_pages,
+                    return_length=True,
+                    return_attention_mask=False,
+                    return_token_type_ids=False,
+                )["length"]
+
+            for page, token_count in zip(unique_pages, token_counts):
+                total += token_count * page_occurrences[page]
+
+        counts.append((book.barcode, already_exists, total))
+
+    return counts
@@ -1,7 +1,12 @@
+import os
 import csv
+import math
 import traceback
+import multiprocessing
+from typing import Iterator
 from pathlib import Path
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 import click
 from slugify import slugify
@@ -9,10 +14,13 @@ from loguru import logger
 
 import utils
 from models import BookIO, TopicClassification, TopicClassificationTrainingDataset
-from const import EXPORT_DIR_PATH, DATETIME_SLUG
+from const import EXPORT_DIR_PATH, MODELS_DIR_PATH, DATETIME_SLUG
 
 MODEL_NAME = "institutional/institutional-books-topic-classifier-bert"
 
+PROMPTS_WINDOW_BATCHES = 16
+""" Number of inference batches worth of prompts that are grouped by length before being classified. """
+
 
 @click.command("run-topic-classification")
 @click.option(
@@ -27,6 +35,12 @@ MODEL_NAME = "institutional/institutional-books-topic-classifier-bert"
     required=False,
     help=f"If set, allows to specify on which device the model should run.",
 )
+@click.option(
+    "--overwrite",
+    is_flag=True,
+    default=False,
+    help="If set, also re-classifies records that were already classified by the current model.",
+)
 @click.option(
     "--offset",
     type=int,
@@ -46,13 +60,54 @@ MODEL_NAME = "institutional/institutional-books-topic-classifier-bert"
     default=10_000,
     help="Determines the frequency at which the database will be updated (every X entries). By default: every 10,000 entries.",
 )
+@click.option(
+    "--inference-batch-size",
+    type=int,
+    required=False,
+    default=64,
+    help="Determines how many prompts are sent to the model at once. By default: 64.",
+)
+@click.option(
+    "--torch-dtype",
+    type=click.Choice(["float32", "bfloat16", "float16", "auto"]),
+    required=False,
+    default="float32",
+    help="Precision the model should run at. `bfloat16` / `float16` are faster on supported hardware. `auto` picks the fastest one available on `--device`. By default: float32.",
+)
+@click.option(
+    "--runtime",
+    type=click.Choice(["torch", "onnx"]),
+    required=False,
+    default="torch",
+    help="Runtime the model should be run with. `onnx` is usually faster on CPU, and requires `optimum[onnxruntime]`. By default: torch.",
+)
+@click.option(
+    "--instances",
+    type=int,
+    required=False,
+    default=1,
+    help="Number of model instances to run in parallel, each on its own subprocess and slice of the collection. Mostly useful for CPU inference. By default: 1.",
+)
+@click.option(
+    "--compile",
+    "compile_model",
+    is_flag=True,
+    default=False,
+    help="If set, compiles the model with `torch.compile` before running inference.",
+)
 @utils.needs_pipeline_ready
 def run_topic_classification(
     benchmark_mode: bool,
     device: str | None,
+    overwrite: bool,
     offset: int | None,
     limit: int | None,
     db_write_batch_size: int,
+    inference_batch_size: int,
+    torch_dtype: str,
+    runtime: str,
+    instances: int,
+    compile_model: bool,
 ):
     """
     Runs a topic classification model on the collection.
@@ -60,7 +115,11 @@ def run_topic_classification(
     Notes:
     - The model was trained on the data filtered by `extract-topic-classification-training-dataset`
     - This command updates `TopicClassification` records
+    - Skips records that were already classified by the current model, unless instructed otherwise.
     - Uses `institutional/institutional-books-topic-classifier-bert` by default
+    - `--torch-dtype` and `--compile` can be used to speed up inference on supported hardware. Consider running in benchmark mode first to check their impact on accuracy.
+    - `--runtime="onnx"` runs the model with ONNX Runtime, which is usually faster on CPU. The exported model is cached under `MODELS_DIR_PATH`.
+    - `--instances` splits the collection between multiple model instances running in parallel, sharing CPU threads evenly. Not used in benchmark mode.
 
     Benchmark mode:
     - Runs topic classification model on 1000 records set aside for benchmarking purposes.
@@ -100,34 +159,137 @@ def run_topic_classification(
         logger.error("Topic classification dataset is not ready")
         exit(1)
 
+    #
+    # Full processing mode, across multiple model instances
+    #
+    if instances > 1 and not benchmark_mode:
+        run_on_collection_instances(
+            instances,
+            (device, runtime, torch_dtype, compile_model),
+            overwrite,
+            offset,
+            limit,
+            db_write_batch_size,
+            inference_batch_size,
+        )
+        exit(0)
+
+    #
+    # Load model
+    #
+    try:
+        pipe = load_pipeline(device, runtime, torch_dtype, compile_model)
+    except Exception:
+        logger.debug(traceback.format_exc())
+        logger.error(f"Could not load {MODEL_NAME} ({runtime}). Interrupting.")
+        exit(1)
+
     #
     # Isolated benchmark mode
     #
     if benchmark_mode:
-        run_benchmark(device)
+        run_benchmark(pipe, inference_batch_size)
         exit(0)
 
     #
     # Full processing mode
     #
-    run_on_collection(device, offset, limit, db_write_batch_size)
+    run_on_collection(pipe, overwrite, offset, limit, db_write_batch_size, inference_batch_size)
 
 
-def run_on_collection(
-    device: str | None,
+def run_on_collection_instances(
+    instances: int,
+    pipeline_args: tuple,
+    overwrite: bool,
     offset: int | None,
     limit: int | None,
     db_write_batch_size: int,
+    inference_batch_size: int,
 ):
     """
-    Run classfication model against collection, update TopicClassification records.
+    Splits the target slice of the collection in `instances` contiguous shards, and runs `run_on_collection()` on each of them in parallel.
+    Each subprocess loads its own copy of the model (see `load_pipeline()`, which `pipeline_args` are passed to).
+
+    Notes:
+    - Available CPU threads are split evenly between instances, which tends to perform better than a single instance using all of them.
+    - Each instance saves its own results, in batches.
     """
-    from transformers import pipeline  # Slow import
+    offset = offset if offset else 0
+    items_count = TopicClassification.select().offset(offset).limit(limit).count()
+    shard_size = math.ceil(items_count / instances)
+    num_threads = max(1, multiprocessing.cpu_count() // instances)
 
-    pipe = pipeline("text-classification", model=MODEL_NAME, device=device)
+    shards = [
+        (shard_offset, min(shard_size, offset + items_count - shard_offset))
+        for shard_offset in range(offset, offset + items_count, max(shard_size, 1))
+    ]
 
-    items_count = TopicClassification.select().offset(offset).limit(limit).count()
+    with ProcessPoolExecutor(max_workers=len(shards) or 1) as executor:
+        futures = [
+            executor.submit(
+                run_instance,
+                pipeline_args,
+                num_threads,
+                overwrite,
+                shard_offset,
+                shard_limit,
+                db_write_batch_size,
+                inference_batch_size,
+            )
+            for shard_offset, shard_limit in shards
+        ]
+
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                logger.debug(traceback.format_exc())
+                logger.error("Could not run topic classification. Interrupting.")
+                executor.shutdown(wait=False, cancel_futures=True)
+                exit(1)
+
+
+def run_instance(
+    pipeline_args: tuple,
+    num_threads: int,
+    overwrite: bool,
+    offset: int,
+    limit: int,
+    db_write_batch_size: int,
+    inference_batch_size: int,
+) -> bool:
+    """
+    Loads a model instance limited to `num_threads` CPU threads, and runs it on a shard of the collection.
+    Meant to be run in a subprocess (see `run_on_collection_instances()`).
+    """
+    import torch
+
+    # NOTE: Subprocesses are forked from a parent that already imported torch (via `utils`),
+    # so `OMP_NUM_THREADS` would have no effect here: the thread pool is limited at runtime instead.
+    torch.set_num_threads(num_threads)
+
+    logger.info(f"Instance started: {limit} records from offset {offset}, {num_threads} thread(s)")
+
+    pipe = load_pipeline(*pipeline_args)
+    run_on_collection(pipe, overwrite, offset, limit, db_write_batch_size, inference_batch_size)
+
+    return True
+
+
+def run_on_collection(
+    pipe,
+    overwrite: bool,
+    offset: int | None,
+    limit: int | None,
+    db_write_batch_size: int,
+    inference_batch_size: int,
+):
+    """
+    Run classfication model against collection, update TopicClassification records.
+    Records that were already classified by MODEL_NAME are skipped, unless `overwrite` is set.
+    """
     items_to_update = []
+    batch_start_datetime = datetime.now()
 
     fields_to_update = [
         TopicClassification.from_detection,
@@ -135,42 +297,277 @@ def run_on_collection(
         TopicClassification.detection_source,
     ]
 
-    for i, item in enumerate(
-        TopicClassification.select()
+    # NOTE: BookIO is joined in so `item.book` doesn't need to be fetched separately for each record.
+    items = (
+        TopicClassification.select(TopicClassification, BookIO)
+        .join(BookIO)
         .offset(offset)
         .limit(limit)
         .order_by(TopicClassification.book)
-        .iterator(),
-        start=1,
-    ):
+        .iterator()
+    )
 
-        # Run detection on item
-        try:
-            prompt = utils.get_metadata_as_text_prompt(item.book, skip_topic=True, skip_genre=True)
-            result = pipe(prompt)
+    # Prompts are classified in windows of several inference batches, so they can be grouped by length (see `classify_prompts()`).
+    prompts_window_size = inference_batch_size * PROMPTS_WINDOW_BATCHES
 
-            item.from_detection = result[0]["label"]
-            item.detection_confidence = result[0]["score"]
-            item.detection_source = MODEL_NAME
+    # NOTE: Prompts for the next batch are built in a background thread while the current batch is being classified.
+    # `items` is only ever consumed from that single thread.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_batch = executor.submit(build_prompts_batch, items, prompts_window_size, overwrite)
 
-            items_to_update.append(item)
+        while True:
+            items_to_classify, prompts = next_batch.result()
 
-            logger.info(f"#{item.book.barcode} = {item.from_detection} from {item.from_metadata}")
+            if not items_to_classify:
+                break
+
+            next_batch = executor.submit(build_prompts_batch, items, prompts_window_size, overwrite)
+
+            # Run detection on items in batches
+            items_to_update.extend(
+                classify_items(pipe, items_to_classify, prompts, inference_batch_size)
+            )
+
+            # Update database records in batches
+            # NOTE: Records are written as upserts: a single `INSERT ... ON CONFLICT DO UPDATE` per chunk instead of `CASE`-based bulk updates.
+            if len(items_to_update) >= db_write_batch_size:
+                logger.info(
+                    f"Saving {len(items_to_update)} records (batch processed in {datetime.now() - batch_start_datetime})"
+                )
+                utils.process_db_upsert_batch(
+                    TopicClassification,
+                    items_to_update,
+                    fields_to_update,
+                )
+                batch_start_datetime = datetime.now()
+
+    # Save remaining items
+    if items_to_update:
+        logger.info(
+            f"Saving {len(items_to_update)} records (batch processed in {datetime.now() - batch_start_datetime})"
+        )
+
+    utils.process_db_upsert_batch(
+        TopicClassification,
+        items_to_update,
+        fields_to_update,
+    )
+
+
+def load_pipeline(
+    device: str | None,
+    runtime: str = "torch",
+    torch_dtype: str = "float32",
+    compile_model: bool = False,
+):
+    """
+    Loads the text classification pipeline for MODEL_NAME.
+    - `runtime` determines whether the model runs with `torch` or `onnx` (ONNX Runtime).
+    - `torch_dtype` determines the precision the model runs at (`float32`, `bfloat16`, `float16` or `auto`).
+    - If `compile_model` is set, the model is compiled using `torch.compile` and warmed up before being returned.
+
+    Notes:
+    - `torch_dtype` and `compile_model` only apply to the `torch` runtime.
+    """
+    if runtime == "onnx":
+        return load_onnx_pipeline(device)
+
+    # Let PyTorch's CUDA caching allocator grow its segments instead of allocating new ones as batch shapes vary.
+    # NOTE: Read when the allocator is first used, not when torch is imported. Can be overridden via env.
+    os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
+    import torch  # Slow import
+    from transformers import pipeline  # Slow import
+
+    if torch_dtype == "auto":
+        torch_dtype = get_fastest_torch_dtype(device)
+        logger.info(f"Using {torch_dtype} precision")
+
+    pipe = pipeline(
+        "text-classification",
+        model=MODEL_NAME,
+        device=device,
+        torch_dtype=getattr(torch, torch_dtype),
+    )
+
+    # Inference only: no autograd bookkeeping needed
+    # NOTE: Pipelines run forward passes under `no_grad` already, this also covers anything running outside of them.
+    pipe.model.eval()
+    torch.set_grad_enabled(False)
+
+    # NOTE: "reduce-overhead" uses CUDA graphs when available, which mostly help with repeated small-batch inference.
+    # `dynamic=True` avoids recompiling the model for every new sequence length.
+    if compile_model:
+        pipe.model = torch.compile(
+            pipe.model,
+            mode="reduce-overhead",
+            fullgraph=False,
+            dynamic=True,
+        )
+
+        # Warm up: compilation happens on first call, and shouldn't be accounted for in benchmark timings.
+        logger.info("Compiling model ...")
+        pipe(["warmup " * 16] * 2, batch_size=2, truncation=True)
+
+    return pipe
+
+
+def load_onnx_pipeline(device: str | None):
+    """
+    Loads the text classification pipeline for MODEL_NAME, running on ONNX Runtime.
+    The model is exported to ONNX on first use, and cached under `MODELS_DIR_PATH`.
+    """
+    from transformers import pipeline, AutoTokenizer  # Slow import
+    from optimum.onnxruntime import ORTModelForSequenceClassification  # Optional dependency
+
+    export_path = Path(MODELS_DIR_PATH, f"{slugify(MODEL_NAME)}-onnx")
+
+    if export_path.exists():
+        model = ORTModelForSequenceClassification.from_pretrained(export_path)
+    else:
+        logger.info(f"Exporting {MODEL_NAME} to ONNX ...")
+        model = ORTModelForSequenceClassification.from_pretrained(MODEL_NAME, export=True)
+        model.save_pretrained(export_path)
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+
+    return pipeline("text-classification", model=model, tokenizer=tokenizer, device=device)
+
+
+def get_fastest_torch_dtype(device: str | None) -> str:
+    """
+    Returns the name of the reduced-precision dtype best suited for inference on `device`:
+    - `bfloat16` on CUDA devices that support it (Ampere and up), `float16` on other CUDA devices.
+    - `float32` otherwise, as reduced precision support on CPU / MPS varies too much from one machine to the next.
+    """
+    import torch  # Slow import
+
+    if not device or not str(device).startswith("cuda") or not torch.cuda.is_available():
+        return "float32"
+
+    if torch.cuda.is_bf16_supported():
+        return "bfloat16"
+
+    return "float16"
+
+
+def build_prompts_batch(
+    items: Iterator[TopicClassification],
+    batch_size: int,
+    overwrite: bool = False,
+) -> tuple[list[TopicClassification], list[str]]:
+    """
+    Pulls records from `items` and builds their prompts, until `batch_size` prompts are ready or `items` is exhausted.
+    Returns a `(items, prompts)` tuple. Both lists are empty once `items` is exhausted.
+
+    Notes:
+    - Records for which a prompt could not be built are skipped.
+    - Records that were already classified by MODEL_NAME are skipped, unless `overwrite` is set.
+    """
+    items_to_classify = []
+    prompts = []
+
+    for item in items:
+        # NOTE: Checked here rather than in SQL so `offset` / `limit` keep targeting the same slice of the collection across runs.
+        if not overwrite and item.detection_source == MODEL_NAME:
+            logger.debug(f"#{item.book_id} already classified")
+            continue
+
+        try:
+            prompts.append(
+                utils.get_metadata_as_text_prompt(item.book, skip_topic=True, skip_genre=True)
+            )
+            items_to_classify.append(item)
         except Exception:
             logger.debug(traceback.format_exc())
             logger.error(f"⏭️ Could not run classifier on #{item.book.barcode}. Skipping.")
 
-        # Update database records in batches
-        if len(items_to_update) >= db_write_batch_size or i >= items_count:
-            utils.process_db_write_batch(
-                TopicClassification,
-                [],
-                items_to_update,
-                fields_to_update,
-            )
+        if len(prompts) >= batch_size:
+            break
+
+    return (items_to_classify, prompts)
+
 
+def classify_items(
+    pipe,
+    items: list[TopicClassification],
+    prompts: list[str],
+    inference_batch_size: int,
+) -> list[TopicClassification]:
+    """
+    Runs detection on a batch of TopicClassification records, using their matching `prompts`.
+    Returns the records that were successfully classified.
+
+    Notes:
+    - `items` and `prompts` are emptied in place
+    """
+    classified_items = []
+
+    for item, result in zip(items, classify_prompts(pipe, prompts, inference_batch_size)):
+        if result is None:
+            logger.error(f"⏭️ Could not run classifier on #{item.book.barcode}. Skipping.")
+            continue
+
+        item.from_detection = result["label"]
+        item.detection_confidence = result["score"]
+        item.detection_source = MODEL_NAME
+
+        classified_items.append(item)
+
+        logger.debug(f"#{item.book.barcode} = {item.from_detection} from {item.from_metadata}")
+
+    items.clear()
+    prompts.clear()
 
-def run_benchmark(device: str | None):
+    return classified_items
+
+
+def classify_prompts(pipe, prompts: list[str], inference_batch_size: int) -> list[dict | None]:
+    """
+    Runs the classification pipeline on a list of prompts, `inference_batch_size` prompts at a time.
+    Returns one `{"label": ..., "score": ...}` dict per prompt, or `None` for prompts that could not be classified.
+
+    Notes:
+    - Prompts are grouped by length before being batched, to minimize padding.
+    - If a batch fails as a whole, its prompts are retried one by one so a single problematic prompt doesn't take down the others.
+    """
+    if not prompts:
+        return []
+
+    # Prompts are sent sorted by length, so each batch groups prompts of similar length and carries less padding.
+    # Results are put back in the original order.
+    # NOTE: Character length is used as a cheap proxy for token length.
+    order = sorted(range(len(prompts)), key=lambda i: len(prompts[i]))
+
+    try:
+        sorted_results = pipe(
+            [prompts[i] for i in order],
+            batch_size=inference_batch_size,
+            truncation=True,
+        )
+
+        results = [None] * len(prompts)
+
+        for i, result in zip(order, sorted_results):
+            results[i] = result
+
+        return results
+    except Exception:
+        logger.debug(traceback.format_exc())
+
+    results = []
+
+    for prompt in prompts:
+        try:
+            results.append(pipe(prompt, truncation=True)[0])
+        except Exception:
+            logger.debug(traceback.format_exc())
+            results.append(None)
+
+    return results
+
+
+def run_benchmark(pipe, inference_batch_size: int):
     """
     Runs the classification model against records set aside for benchmarking purposes.
     Yields benchmark scores and a summary sheet.
@@ -178,8 +575,6 @@ def run_benchmark(device: str | None):
     logger.info("Running topic classification task in benchmark mode")
     logger.info(f"🧪 Target model: {MODEL_NAME}")
 
-    pipe = pipeline("text-classification", model=MODEL_NAME, device=device)
-
     rows = []
 
     row_template = {
@@ -202,7 +597,8 @@ def run_benchmark(device: str | None):
     # Evaluate
     #
     for item in (
-        TopicClassificationTrainingDataset.select()
+        TopicClassificationTrainingDataset.select(TopicClassificationTrainingDataset, BookIO)
+        .join(BookIO)
         .where(TopicClassificationTrainingDataset.set == "benchmark")
         .iterator()
     ):
@@ -213,12 +609,14 @@ def run_benchmark(device: str | None):
         row["target_topic"] = item.target_topic
         row["model_name"] = MODEL_NAME
 
-        try:
-            result = pipe(row["prompt"])
-            row["detected_topic"] = result[0]["label"]
-            row["confidence"] = result[0]["score"]
-        except:
-            pass
+        rows.append(row)
+
+    results = classify_prompts(pipe, [row["prompt"] for row in rows], inference_batch_size)
+
+    for row, result in zip(rows, results):
+        if result is not None:
+            row["detected_topic"] = result["label"]
+            row["confidence"] = result["score"]
 
         if row["detected_topic"] == row["target_topic"]:
             row["match"] = "YES"
@@ -227,8 +625,6 @@ def run_benchmark(device: str | None):
             row["match"] = "NO"
             total_invalid += 1
 
-        rows.append(row)
-
     end = datetime.now()
 
     #
@@ -239,10 +635,10 @@ def run_benchmark(device: str | None):
         f"topic-classification-benchmark-{slugify(MODEL_NAME)}-{DATETIME_SLUG}.csv",
     )
 
-    with open(output_filepath, "w+") as fd:
+    with open(output_filepath, "w+", newline="") as fd:
         writer = csv.writer(fd)
         writer.writerow(list(row_template.keys()))
-        [writer.writerow(list(row.values())) for row in rows]
+        writer.writerows(row.values() for row in rows)
 
     logger.info(f"{output_filepath.name} saved to disk")
 
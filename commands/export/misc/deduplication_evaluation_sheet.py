@@ -10,6 +10,9 @@ import utils
 from models import BookIO, ScannedTextSimhash
 from const import EXPORT_DIR_PATH, DATETIME_SLUG
 
+HEADERS = ["simhash"] + [f"gbooks_url_{i}" for i in range(1, 21)]
+""" Headers of the evaluation sheet: simhash, gbooks_url_{1...20} """
+
 
 @click.command("deduplication-evaluation-sheet")
 @click.option(
@@ -47,41 +50,32 @@ def deduplication_evaluation_sheet(n_samples: int, max_workers: int):
     logger.info("Collecting likely duplicates ...")
     hashes_to_books = utils.get_filtered_duplicates(max_workers)
 
-    # Pick `n_samples` hashes (quadruple `n_samples` to account for export filters)
-    hashes_to_books_sample = list(hashes_to_books.keys())
-    random.shuffle(hashes_to_books_sample)
-    hashes_to_books_sample = hashes_to_books_sample[0 : int(n_samples * 4)]
+    # Pick `n_samples` hashes
+    # NOTE: `get_filtered_duplicates()` already discards groups with fewer than 2 books,
+    # so every hash it returns qualifies and can be sampled from directly.
+    hashes_to_books_sample = random.sample(
+        list(hashes_to_books.keys()),
+        min(n_samples, len(hashes_to_books)),
+    )
 
     #
     # Export samples
     #
-    logger.info(f"Saving {n_samples} samples ...")
+    logger.info(f"Saving {len(hashes_to_books_sample)} samples ...")
 
     output_filepath = Path(
         EXPORT_DIR_PATH,
         f"deduplication-eval-sheet-{n_samples}-{DATETIME_SLUG}.csv",
     )
 
-    with open(output_filepath, "w+") as fd:
+    # NOTE: `newline=""` as recommended by the `csv` module.
+    with open(output_filepath, "w+", newline="") as fd:
         writer = csv.writer(fd)
-        samples_written = 0
-
-        # Headers = simhash, gbooks_url_{1...20}
-        writer.writerow(["simhash"] + [f"gbooks_url_{i}" for i in range(1, 21)])
+        writer.writerow(HEADERS)
 
         for simhash in hashes_to_books_sample:
-            books = hashes_to_books[simhash]
             gbooks_urls = []
 
-            if samples_written >= n_samples:
-                break
-
-            # Focus on items that have at least 1 likely duplicate
-            if len(books) < 2:
-                continue
-
             writer.writerow([simhash] + gbooks_urls)
 
-            samples_written += 1
-
-    logger.info(f"{output_filepath.name} saved to disk ({n_samples} samples)")
+    logger.info(f"{output_filepath.name} saved to disk ({len(hashes_to_books_sample)} samples)")
@@ -1,6 +1,11 @@
 from pathlib import Path
 import csv
+import gzip
 import os
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from operator import itemgetter
 
 import click
 from loguru import logger
@@ -58,6 +63,9 @@ FIELDS_TO_EXPORT = [
     Focuses on basic GRIN metrics and MARC fields.
 """
 
+ROW_GETTER = itemgetter(*FIELDS_TO_EXPORT)
+""" Picks the values of `FIELDS_TO_EXPORT` from a metadata dict, in order. """
+
 
 @click.command("simplified-source-metadata")
 @click.option(
@@ -67,13 +75,33 @@ FIELDS_TO_EXPORT = [
     default=False,
     help="If set, ignores rights determination checks.",
 )
+@click.option(
+    "--gzip",
+    "use_gzip",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="If set, compresses the output file using gzip.",
+)
+@click.option(
+    "--max-workers",
+    type=int,
+    required=False,
+    default=multiprocessing.cpu_count(),
+    help="Determines how many subprocesses can be run in parallel.",
+)
 @utils.needs_pipeline_ready
-def simplified_source_metadata(include_non_pd: bool):
+def simplified_source_metadata(include_non_pd: bool, use_gzip: bool, max_workers: int):
     """
     Simplified CSV export of the source metadata extracted from Google Books.
 
     Saved as:
     - `/data/output/export/simplified-source-metadata-{pd}-{datetime}.csv`
+    - `/data/output/export/simplified-source-metadata-{pd}-{datetime}.csv.gz` (`--gzip`)
+
+    Notes:
+    - Rows are prepared in parallel, but written in order (sorted by barcode).
+    - `--gzip` uses the lowest compression level: metadata is repetitive enough to compress well, and writing stays fast.
     """
     output_filepath = None
     pd_only = not include_non_pd
@@ -83,32 +111,65 @@ def simplified_source_metadata(include_non_pd: bool):
         f"simplified-source-metadata-{"pd-" if pd_only else ""}{DATETIME_SLUG}.csv",
     )
 
+    if use_gzip:
+        output_filepath = output_filepath.with_suffix(".csv.gz")
+
     ht_collection_prefix = os.getenv("HATHITRUST_COLLECTION_PREFIX", "")
 
-    with open(output_filepath, "w+") as fd:
+    # NOTE: `newline=""` as recommended by the `csv` module, larger buffer to reduce the number of writes.
+    with (
+        (
+            gzip.open(output_filepath, "wt", newline="", compresslevel=1)
+            if use_gzip
+            else open(output_filepath, "w+", newline="", buffering=1 << 20)
+        ) as fd,
+        ProcessPoolExecutor(max_workers=max_workers) as executor,
+    ):
         writer = csv.writer(fd)
-
         writer.writerow(FIELDS_TO_EXPORT)
 
-        for book in BookIO.select().order_by(BookIO.barcode).iterator():
-            row = []
-
-            if pd_only and not utils.is_pd(book):
-                continue
+        chunksize = utils.get_map_chunksize(
+            items_count=BookIO.select().count(),
+            max_workers=max_workers,
+        )
 
-            # Addition: Hathitrust Link
-            if ht_collection_prefix:
-                metadata = book.metadata
+        # NOTE: Only the columns needed to retrieve each book's metadata are selected.
+        books = BookIO.select(BookIO.barcode, BookIO.metadata_csv_offset).order_by(BookIO.barcode)
 
-                metadata["Hathitrust Link"] = (
-                    f"https://babel.hathitrust.org/cgi/pt?id={ht_collection_prefix}.{book.barcode.lower()}"
-                )
-            else:
-                metadata["Hathitrust Link"] = ""
+        # Filter out non-PD books in SQL when possible, so subprocesses don't have to check them one by one
+        if pd_only:
+            books, is_filtered = utils.select_pd_books(books)
+            pd_only = not is_filtered
 
-            for field in FIELDS_TO_EXPORT:
-                row.append(book.metadata[field])
+        # NOTE: `executor.map()` returns results in the order books were sent in.
+        rows = executor.map(
+            partial(get_row, pd_only=pd_only, ht_collection_prefix=ht_collection_prefix),
+            books.iterator(),
+            chunksize=chunksize,
+        )
 
-            writer.writerow(row)
+        writer.writerows(row for row in rows if row is not None)
 
     logger.info(f"{output_filepath.name} saved to disk")
+
+
+def get_row(book: BookIO, pd_only: bool, ht_collection_prefix: str) -> tuple | None:
+    """
+    Returns a row of `FIELDS_TO_EXPORT` values for a given book.
+    Returns `None` if `pd_only` is set and the book is not likely PD.
+    """
+    if pd_only and not utils.is_pd(book):
+        return None
+
+    # NOTE: Metadata is resolved once per book and only the exported fields are read from it.
+    metadata = book.metadata
+
+    # Addition: Hathitrust Link
+    if ht_collection_prefix:
+        metadata["Hathitrust Link"] = (
+            f"https://babel.hathitrust.org/cgi/pt?id={ht_collection_prefix}.{book.barcode.lower()}"
+        )
+    else:
+        metadata["Hathitrust Link"] = ""
+
+    return ROW_GETTER(metadata)
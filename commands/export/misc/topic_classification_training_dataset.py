@@ -1,17 +1,26 @@
 import csv
+import multiprocessing
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 
 import click
 from loguru import logger
 
 import utils
-from models import TopicClassificationTrainingDataset
+from models import BookIO, TopicClassificationTrainingDataset
 from const import EXPORT_DIR_PATH, DATETIME_SLUG
 
 
 @click.command("topic-classification-training-dataset")
+@click.option(
+    "--max-workers",
+    type=int,
+    required=False,
+    default=multiprocessing.cpu_count(),
+    help="Determines how many subprocesses can be run in parallel.",
+)
 @utils.needs_pipeline_ready
-def topic_classification_training_dataset():
+def topic_classification_training_dataset(max_workers: int):
     """
     Exports the topic classification training dataset prepared via `analyze extract-topic-classification-training-dataset` as a series of CSVs.
 
@@ -20,29 +29,51 @@ def topic_classification_training_dataset():
 
     Saved as:
     - `/data/output/export/topic-classification-training-dataset-{set}-{datetime}.csv`
+
+    Notes:
+    - Rows are prepared in parallel, but written in order.
     """
-    for set in ["train", "test", "benchmark"]:
-        output_filepath = Path(
-            EXPORT_DIR_PATH,
-            f"topic-classification-training-dataset-{set}-{DATETIME_SLUG}.csv",
-        )
-
-        with open(output_filepath, "w+") as fd:
-            writer = csv.writer(fd)
-            writer.writerow(["text", "target"])
-
-            for entry in (
-                TopicClassificationTrainingDataset.select()
-                .where(TopicClassificationTrainingDataset.set == set)
-                .iterator()
-            ):
-                text = utils.get_metadata_as_text_prompt(
-                    entry.book,
-                    skip_topic=True,
-                    skip_genre=True,
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for set in ["train", "test", "benchmark"]:
+            output_filepath = Path(
+                EXPORT_DIR_PATH,
+                f"topic-classification-training-dataset-{set}-{DATETIME_SLUG}.csv",
+            )
+
+            # NOTE: Books are joined in, instead of being fetched one by one by subprocesses.
+            entries = (
+                TopicClassificationTrainingDataset.select(
+                    TopicClassificationTrainingDataset, BookIO
                 )
-                target = entry.target_topic
+                .join(BookIO)
+                .where(TopicClassificationTrainingDataset.set == set)
+            )
+
+            chunksize = utils.get_map_chunksize(
+                items_count=entries.count(),
+                max_workers=max_workers,
+            )
+
+            # NOTE: `newline=""` as recommended by the `csv` module, larger buffer to reduce the number of writes.
+            with open(output_filepath, "w+", newline="", buffering=1 << 20) as fd:
+                writer = csv.writer(fd)
+                writer.writerow(["text", "target"])
 
-                writer.writerow([text, target])
+                # NOTE: `executor.map()` returns results in the order entries were sent in.
+                writer.writerows(executor.map(get_row, entries.iterator(), chunksize=chunksize))
 
             logger.info(f"{output_filepath.name} saved to disk")
+
+
+def get_row(entry: TopicClassificationTrainingDataset) -> list:
+    """
+    Returns a `[text, target]` row for a given entry of the topic classification training dataset.
+    """
+    text = utils.get_metadata_as_text_prompt(
+        entry.book,
+        skip_topic=True,
+        skip_genre=True,
+    )
+    target = entry.target_topic
+
+    return [text, target]
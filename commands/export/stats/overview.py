@@ -124,6 +124,7 @@ def token_count_stats(writer: csv.writer):
         )
         .group_by(TokenCount.target_llm)
         .order_by(TokenCount.target_llm.desc())
+        .namedtuples()
     ):
         insert_row(
             writer,
@@ -142,6 +143,7 @@ def token_count_stats(writer: csv.writer):
         )
         .group_by(TokenCount.target_llm)
         .order_by(TokenCount.target_llm.desc())
+        .namedtuples()
     ):
         insert_row(
             writer,
@@ -194,18 +196,29 @@ def page_count_stats(writer: csv.writer):
     """
     insert_section(writer, "PAGE COUNT")
 
+    # NOTE: Aggregates are computed in a single pass over the table.
+    total_pages, average_pages, max_pages = (
+        PageCount.select(
+            fn.SUM(PageCount.count_from_ocr),
+            fn.AVG(PageCount.count_from_ocr),
+            fn.MAX(PageCount.count_from_ocr),
+        )
+        .tuples()
+        .get()
+    )
+
     # Total pages
     insert_row(
         writer,
         "Total pages",
-        PageCount.select(fn.SUM(PageCount.count_from_ocr)).scalar(),
+        total_pages,
     )
 
     # Average pages
     insert_row(
         writer,
         "Average page count",
-        PageCount.select(fn.AVG(PageCount.count_from_ocr)).scalar(),
+        average_pages,
     )
 
     #
@@ -215,7 +228,7 @@ def page_count_stats(writer: csv.writer):
 
     page_count_bins = np.logspace(
         np.log10(10),
-        np.log10(PageCount.select(fn.MAX(PageCount.count_from_ocr)).scalar()),
+        np.log10(max_pages),
         16,
     )
 
@@ -309,6 +322,7 @@ def main_language_stats(writer: csv.writer):
         .where(MainLanguage.from_metadata_iso639_3.is_null(False))
         .group_by(MainLanguage.from_metadata_iso639_3)
         .order_by(MainLanguage.from_metadata_iso639_3)
+        .namedtuples()
     ):
         if not item.from_metadata_iso639_3.strip():
             continue
@@ -333,6 +347,7 @@ def main_language_stats(writer: csv.writer):
         .where(MainLanguage.from_detection_iso639_3.is_null(False))
         .group_by(MainLanguage.from_detection_iso639_3)
         .order_by(MainLanguage.from_detection_iso639_3)
+        .namedtuples()
     ):
         if not item.from_detection_iso639_3.strip():
             continue
@@ -428,6 +443,7 @@ def hathitrust_rights_determination_stats(writer: csv.writer):
         .where(HathitrustRightsDetermination.rights_code.is_null(False))
         .group_by(HathitrustRightsDetermination.rights_code)
         .order_by(HathitrustRightsDetermination.rights_code.desc())
+        .namedtuples()
     ):
         insert_row(
             writer,
@@ -446,6 +462,7 @@ def hathitrust_rights_determination_stats(writer: csv.writer):
         .where(HathitrustRightsDetermination.reason_code.is_null(False))
         .group_by(HathitrustRightsDetermination.reason_code)
         .order_by(HathitrustRightsDetermination.reason_code.desc())
+        .namedtuples()
     ):
         insert_row(
             writer,
@@ -500,6 +517,7 @@ def year_of_publication_stats(writer: csv.writer):
         )
         .group_by(YearOfPublication.century)
         .order_by(YearOfPublication.century)
+        .namedtuples()
     ):
 
         if not item.century:
@@ -528,6 +546,7 @@ def year_of_publication_stats(writer: csv.writer):
         .where(YearOfPublication.decade.is_null(False))
         .group_by(YearOfPublication.decade)
         .order_by(YearOfPublication.decade)
+        .namedtuples()
     ):
         if not item.decade:
             continue
@@ -559,30 +578,48 @@ def ocr_quality_stats(writer: csv.writer):
     #
     insert_section(writer, "OCR QUALITY - OVERVIEW")
 
+    # NOTE: Aggregates are computed in a single pass over the table.
+    # `COUNT(column)` skips NULL values: books with no score are the difference with the total.
+    (
+        average_from_metadata,
+        average_from_detection,
+        no_score_from_metadata,
+        no_score_from_detection,
+    ) = (
+        OCRQuality.select(
+            fn.AVG(OCRQuality.from_metadata),
+            fn.AVG(OCRQuality.from_detection),
+            fn.COUNT(OCRQuality.book) - fn.COUNT(OCRQuality.from_metadata),
+            fn.COUNT(OCRQuality.book) - fn.COUNT(OCRQuality.from_detection),
+        )
+        .tuples()
+        .get()
+    )
+
     # Average
     insert_row(
         writer,
         f"Google Books-provided - Average",
-        OCRQuality.select(fn.AVG(OCRQuality.from_metadata)).scalar(),
+        average_from_metadata,
     )
 
     insert_row(
         writer,
         f"pleias/OCRoscope - Average",
-        OCRQuality.select(fn.AVG(OCRQuality.from_detection)).scalar(),
+        average_from_detection,
     )
 
     # No data
     insert_row(
         writer,
         f"Google Books-provided - Books with no score available",
-        OCRQuality.select().where(OCRQuality.from_metadata.is_null(True)).count(),
+        no_score_from_metadata,
     )
 
     insert_row(
         writer,
         f"pleias/OCRoscope - Books with no score available",
-        OCRQuality.select().where(OCRQuality.from_detection.is_null(True)).count(),
+        no_score_from_detection,
     )
 
     #
@@ -672,6 +709,7 @@ def language_detection_stats(writer: csv.writer):
         )
         .group_by(LanguageDetection.iso639_3)
         .order_by(LanguageDetection.iso639_3)
+        .namedtuples()
     ):
         insert_row(
             writer,
@@ -709,13 +747,9 @@ def deduplication_stats(writer: csv.writer):
         ScannedTextSimhash.select().where(ScannedTextSimhash.hash.is_null(False)).count()
     )
 
-    total_unique_books_with_dupes = 0
-    total_books_with_at_least_one_dupe = 0
-
-    for books in hashes_to_books.values():
-        if len(books) > 1:
-            total_unique_books_with_dupes += 1
-            total_books_with_at_least_one_dupe += len(books)
+    # NOTE: `get_filtered_duplicates()` only returns groups of 2 books or more.
+    total_unique_books_with_dupes = len(hashes_to_books)
+    total_books_with_at_least_one_dupe = sum(len(books) for books in hashes_to_books.values())
 
     insert_row(
         writer,
@@ -758,97 +792,34 @@ def text_analysis_stats(writer: csv.writer):
     """
     insert_section(writer, "TEXT ANALYSIS")
 
-    # Characters
-    insert_row(
-        writer,
-        f"Average character count",
-        TextAnalysis.select(fn.AVG(TextAnalysis.char_count)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average continuous character count",
-        TextAnalysis.select(fn.AVG(TextAnalysis.char_count_continous)).scalar(),
-    )
-
-    # Words
-    insert_row(
-        writer,
-        f"Average word count",
-        TextAnalysis.select(fn.AVG(TextAnalysis.word_count)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average unique words",
-        TextAnalysis.select(fn.AVG(TextAnalysis.word_count_unique)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average word type-token ratio",
-        TextAnalysis.select(fn.AVG(TextAnalysis.word_type_token_ratio)).scalar(),
-    )
-
-    #
-    # Bigrams
-    #
-    insert_row(
-        writer,
-        f"Average bigram count",
-        TextAnalysis.select(fn.AVG(TextAnalysis.bigram_count)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average unique bigrams",
-        TextAnalysis.select(fn.AVG(TextAnalysis.bigram_count_unique)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average bigram type-token ratio",
-        TextAnalysis.select(fn.AVG(TextAnalysis.bigram_type_token_ratio)).scalar(),
-    )
-
-    # Trigrams
-    insert_row(
-        writer,
-        f"Average trigram count",
-        TextAnalysis.select(fn.AVG(TextAnalysis.trigram_count)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average unique tigrams",
-        TextAnalysis.select(fn.AVG(TextAnalysis.trigram_count_unique)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average trigram type-token ratio",
-        TextAnalysis.select(fn.AVG(TextAnalysis.trigram_type_token_ratio)).scalar(),
-    )
-
-    # Sentences
-    insert_row(
-        writer,
-        f"Average sentence count",
-        TextAnalysis.select(fn.AVG(TextAnalysis.sentence_count)).scalar(),
-    )
-
-    insert_row(
-        writer,
-        f"Average unique sentences",
-        TextAnalysis.select(fn.AVG(TextAnalysis.sentence_count_unique)).scalar(),
-    )
-
-    # Tokenizability (o200k_base)
-    insert_row(
-        writer,
-        f"Average tokenizability",
-        TextAnalysis.select(fn.AVG(TextAnalysis.tokenizability_o200k_base_ratio)).scalar(),
-    )
+    averages = [
+        # Characters
+        ("Average character count", TextAnalysis.char_count),
+        ("Average continuous character count", TextAnalysis.char_count_continous),
+        # Words
+        ("Average word count", TextAnalysis.word_count),
+        ("Average unique words", TextAnalysis.word_count_unique),
+        ("Average word type-token ratio", TextAnalysis.word_type_token_ratio),
+        # Bigrams
+        ("Average bigram count", TextAnalysis.bigram_count),
+        ("Average unique bigrams", TextAnalysis.bigram_count_unique),
+        ("Average bigram type-token ratio", TextAnalysis.bigram_type_token_ratio),
+        # Trigrams
+        ("Average trigram count", TextAnalysis.trigram_count),
+        ("Average unique tigrams", TextAnalysis.trigram_count_unique),
+        ("Average trigram type-token ratio", TextAnalysis.trigram_type_token_ratio),
+        # Sentences
+        ("Average sentence count", TextAnalysis.sentence_count),
+        ("Average unique sentences", TextAnalysis.sentence_count_unique),
+        # Tokenizability (o200k_base)
+        ("Average tokenizability", TextAnalysis.tokenizability_o200k_base_ratio),
+    ]
+
+    # NOTE: All averages are computed in a single pass over the table.
+    values = TextAnalysis.select(*[fn.AVG(field) for _, field in averages]).tuples().get()
+
+    for (caption, _), value in zip(averages, values):
+        insert_row(writer, caption, value)
 
 
 def genre_classification_stats(writer: csv.writer):
@@ -894,6 +865,7 @@ def genre_classification_stats(writer: csv.writer):
         .where(GenreClassification.from_metadata.is_null(False))
         .group_by(GenreClassification.from_metadata)
         .order_by(fn.COUNT(GenreClassification.from_metadata).desc())
+        .namedtuples()
     ):
 
         if i >= 50:
@@ -950,6 +922,7 @@ def topic_classification_stats(writer: csv.writer):
         .where(TopicClassification.from_metadata.is_null(False))
         .group_by(TopicClassification.from_metadata)
         .order_by(fn.COUNT(TopicClassification.from_metadata).desc())
+        .namedtuples()
     ):
 
         if i >= 50:
@@ -1009,6 +982,7 @@ def topic_classification_stats(writer: csv.writer):
         .where(TopicClassification.from_detection.is_null(False))
         .group_by(TopicClassification.from_detection)
         .order_by(TopicClassification.from_detection)
+        .namedtuples()
     ):
 
         insert_row(
@@ -1029,6 +1003,7 @@ def topic_classification_stats(writer: csv.writer):
         .where(TopicClassification.from_detection.is_null(False))
         .group_by(TopicClassification.from_detection)
         .order_by(TopicClassification.from_detection)
+        .namedtuples()
     ):
 
         insert_row(
@@ -1069,6 +1044,7 @@ def topic_classification_stats(writer: csv.writer):
             .where(TopicClassificationTrainingDataset.set == set)
             .group_by(TopicClassificationTrainingDataset.target_topic)
             .order_by(TopicClassificationTrainingDataset.target_topic)
+            .namedtuples()
         ):
 
             insert_row(
@@ -11,7 +11,7 @@ from loguru import logger
 
 
 import utils
-from models import BookIO, OCRPostprocessingTrainingDataset
+from models import BookIO, MainLanguage, TextAnalysis, OCRPostprocessingTrainingDataset
 from models.ocr_postprocessing_training_dataset import TARGET_TYPES
 import utils
 
@@ -126,19 +126,23 @@ def step01_generate_training_dataset(
     # - `TextAnalysis.word_count` > 1000
     # - Rights determination indicates the book is in the public domain
     #
-    for book in BookIO.select().order_by(peewee.fn.Random()).iterator():
+    # NOTE: Language and word count are filtered in SQL, so only matching books are shuffled and sent back.
+    # Rights determination is checked in Python, as it depends on `PD_FILTERING_MECHANISM`.
+    for book in (
+        BookIO.select()
+        .join(MainLanguage, on=(MainLanguage.book == BookIO.barcode))
+        .switch(BookIO)
+        .join(TextAnalysis, on=(TextAnalysis.book == BookIO.barcode))
+        .where(
+            MainLanguage.from_detection_iso639_3.in_(list(languages)),
+            TextAnalysis.word_count > 1000,
+        )
+        .order_by(peewee.fn.Random())
+        .iterator()
+    ):
         if len(books) >= n_samples:
             break
 
-        main_language = book.mainlanguage_set[0]
-        text_analysis = book.textanalysis_set[0]
-
-        if main_language.from_detection_iso639_3 not in languages:
-            continue
-
-        if text_analysis.word_count <= 1000:
-            continue
-
         if not utils.is_pd(book):
             continue
 
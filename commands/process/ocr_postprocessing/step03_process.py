@@ -1,4 +1,6 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator
 import traceback
 import re
 from pathlib import Path
@@ -101,48 +103,41 @@ def step03_process(
     # Create batches of books, process them in parallel
     #
     with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = []
-        batch = []
+        items = select_books(offset, limit, languages)
 
-        items_count = BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).count()
+        # NOTE: Upper bound: `select_books()` further filters books by language.
+        items_count = BookIO.select().offset(offset).limit(limit).count()
 
-        batch_max_size = utils.get_batch_max_size(
-            items_count=items_count,
-            max_workers=max_workers,
-        )
-
-        # Create batches of items to process
-        for i, book in enumerate(
-            BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator(),
-            start=1,
-        ):
-
-            # Add book if it matches criteria (language selection, PD)
-            main_language = book.mainlanguage_set[0]
+        try:
+            for _ in utils.map_adaptive_batches(
+                executor,
+                partial(process_batch, classifier_name=classifier_name, overwrite=overwrite),
+                items,
+                max_workers=max_workers,
+                items_count=items_count,
+            ):
+                pass
+        except Exception as err:
+            logger.debug(traceback.format_exc())
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise err
 
-            assert main_language
 
-            if main_language.from_detection_iso639_3 not in languages:
-                continue
+def select_books(offset: int | None, limit: int | None, languages: list) -> Iterator[BookIO]:
+    """
+    Yields books matching this command's criteria (language selection, PD).
+    """
+    for book in BookIO.select().offset(offset).limit(limit).order_by(BookIO.barcode).iterator():
+        main_language = book.mainlanguage_set[0]
 
-            assert utils.is_pd(book)
+        assert main_language
 
-            batch.append(book)
+        if main_language.from_detection_iso639_3 not in languages:
+            continue
 
-            # Send batch for processing
-            if len(batch) >= batch_max_size or i >= items_count:
-                future = executor.submit(process_batch, batch, classifier_name, overwrite)
-                futures.append(future)
-                batch = []
+        assert utils.is_pd(book)
 
-        # Process batches
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception as err:
-                logger.debug(traceback.format_exc())
-                executor.shutdown(wait=False, cancel_futures=True)
-                raise err
+        yield book
 
 
 def process_batch(books: list[BookIO], classifier_name: str, overwrite: bool = False) -> bool:
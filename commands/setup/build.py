@@ -1,7 +1,7 @@
 import csv
 from datetime import datetime
 import traceback
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 
 import click
 from loguru import logger
@@ -100,40 +100,31 @@ def build(
         logger.info("Caching OCR text ...")
 
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            futures = []
-            batch = []
-            items_count = BookIO.select().offset(cache_offset).limit(cache_limit).count()
-
-            batch_max_size = utils.get_batch_max_size(
-                items_count=items_count,
-                max_workers=max_workers,
-            )
-
-            # Create batches of items to process
-            for i, book in enumerate(
+            items = (
                 BookIO.select()
                 .offset(cache_offset)
                 .limit(cache_limit)
                 .order_by(BookIO.barcode)
-                .iterator(),
-                start=1,
-            ):
-                batch.append(book)
-
-                if len(batch) >= batch_max_size or i >= items_count:
-                    future = executor.submit(cache_books_batch, batch)
-                    futures.append(future)
-                    batch = []
-
-            # Run batches in parallel
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception:
-                    logger.debug(traceback.format_exc())
-                    logger.error("Error while refreshing OCR text cache. Interrupting.")
-                    executor.shutdown(wait=False, cancel_futures=True)
-                    exit(1)
+                .iterator()
+            )
+
+            items_count = BookIO.select().offset(cache_offset).limit(cache_limit).count()
+
+            # Cache books in batches, in parallel
+            try:
+                for _ in utils.map_adaptive_batches(
+                    executor,
+                    cache_books_batch,
+                    items,
+                    max_workers=max_workers,
+                    items_count=items_count,
+                ):
+                    pass
+            except Exception:
+                logger.debug(traceback.format_exc())
+                logger.error("Error while refreshing OCR text cache. Interrupting.")
+                executor.shutdown(wait=False, cancel_futures=True)
+                exit(1)
 
 
 def index_collection() -> bool:
@@ -48,7 +48,7 @@ DATETIME_SLUG = datetime_slug = slugify(
 DEFAULT_SIMHASH_SHINGLE_WIDTH = 7
 """ Default size of Simhash shingles. """
 
-HATHITRUST_PD_CODES = ["pd", "pdus", "cc-zero"]
+HATHITRUST_PD_CODES = frozenset(["pd", "pdus", "cc-zero"])
 """ Values of Hathitrust's "rights_code" field that match with public domain. """
 
 HATHITRUST_PD_STRING = "Full view"
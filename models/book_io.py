@@ -95,6 +95,44 @@ class BookIO(peewee.Model):
         if self.__text_by_page is not None:
             return self.__text_by_page
 
+        jsonl_bytes = self.__get_ocr_jsonl_bytes()
+
+        # Parse jsonl_bytes
+        self.__text_by_page = []
+
+        for json_line in jsonl_bytes.decode("utf-8").split("\n"):
+            if not json_line:
+                continue
+
+            self.__text_by_page.append(json.loads(json_line))
+
+        return self.__text_by_page
+
+    @text_by_page.setter
+    def text_by_page(self, value):
+        self.__text_by_page = value
+
+    @property
+    def ocr_page_count(self) -> int:
+        """
+        Returns the number of pages in the OCR'd text of the current volume.
+        Counts lines in the underlying JSONL file without parsing them, unless `text_by_page` is already loaded.
+        """
+        if self.archive_is_available == False:
+            return 0
+
+        if self.__text_by_page is not None:
+            return len(self.__text_by_page)
+
+        jsonl_bytes = self.__get_ocr_jsonl_bytes()
+
+        return sum(1 for json_line in BytesIO(jsonl_bytes) if json_line.rstrip(b"\n"))
+
+    def __get_ocr_jsonl_bytes(self) -> bytes:
+        """
+        Retrieves the raw JSONL file containing the OCR'd text of the current volume.
+        Loaded from disk cache if available, from remote storage otherwise.
+        """
         jsonl_bytes = None
 
         run_name = os.getenv("GRIN_DATA_RUN_NAME")
@@ -134,20 +172,7 @@ class BookIO(peewee.Model):
             with get_cache() as cache:
                 cache.set(cache_key, jsonl_bytes)
 
-        # Parse jsonl_bytes
-        self.__text_by_page = []
-
-        for json_line in jsonl_bytes.decode("utf-8").split("\n"):
-            if not json_line:
-                continue
-
-            self.__text_by_page.append(json.loads(json_line))
-
-        return self.__text_by_page
-
-    @text_by_page.setter
-    def text_by_page(self, value):
-        self.__text_by_page = value
+        return jsonl_bytes
 
     @property
     def merged_text(self) -> str:
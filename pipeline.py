@@ -27,7 +27,10 @@ utils.make_dirs()
 def cli(verbose: bool):
     logger.remove()
     level = "DEBUG" if verbose else "INFO"
-    logger.add(sys.stderr, level=level)
+
+    # NOTE: `enqueue=True` routes log records through a queue consumed by a single thread of the main process,
+    # so subprocesses don't block on (and contend for) stderr.
+    logger.add(sys.stderr, level=level, enqueue=True)
 
 
 cli.add_command(cmd_setup)
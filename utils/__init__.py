@@ -1,4 +1,5 @@
-from .get_batch_max_size import get_batch_max_size
+from .get_map_chunksize import get_map_chunksize
+from .map_adaptive_batches import map_adaptive_batches
 from .get_cache import get_cache
 from .get_db import get_db
 from .get_s3_client import get_s3_client
@@ -10,10 +11,13 @@ from .pipeline_readiness import (
     needs_pipeline_ready,
 )
 from .process_db_write_batch import process_db_write_batch
+from .process_db_upsert_batch import process_db_upsert_batch
+from .flag_existing_records import flag_existing_records
 from .get_simhash_shingles import get_simhash_shingles
+from .get_tiktoken_encoding import get_tiktoken_encoding
 from .get_filtered_duplicates import get_filtered_duplicates
 from .get_metadata_as_text_prompt import get_metadata_as_text_prompt
-from .is_pd import is_pd
+from .is_pd import is_pd, select_pd_books
 from .get_torch_devices import get_torch_devices
 from .data_dependencies import (
     needs_page_count_data,
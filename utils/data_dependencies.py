@@ -1,21 +1,54 @@
 import os
 
+import peewee
 from loguru import logger
 
 from const import OCR_POSTPROCESSING_DIR_PATH
 
 
+def has_missing_records(model: peewee.Model) -> bool:
+    """
+    Returns `True` if at least one BookIO record has no matching entry in `model`.
+
+    Notes:
+    - `model` is expected to have a `book` foreign key pointing to `BookIO.barcode`.
+    - Uses a `LEFT JOIN ... IS NULL` probe that stops at the first orphan, instead of counting both tables.
+    """
+    from models import BookIO
+
+    return (
+        BookIO.select(BookIO.barcode)
+        .join(model, peewee.JOIN.LEFT_OUTER, on=(model.book == BookIO.barcode))
+        .where(model.book.is_null(True))
+        .exists()
+    )
+
+
+def has_more_records_than_books(model: peewee.Model) -> bool:
+    """
+    Returns `True` if `model` has more records than there are BookIO records.
+    Meant for tables holding multiple records per book (e.g: `LanguageDetection`, `TokenCount`).
+
+    Notes:
+    - Probes for a record past the BookIO count (`OFFSET` + `LIMIT 1`), instead of counting the whole table.
+    """
+    from models import BookIO
+
+    # NOTE: `.exists()` would drop the offset, hence `.first()`.
+    return model.select(model.book).offset(BookIO.select().count()).tuples().first() is not None
+
+
 def needs_page_count_data(func):
     """
     Decorator conditioning the execution of a function to:
     - The presence of page count data in the database.
     """
-    from models import BookIO, PageCount
+    from models import PageCount
 
     def wrapper(*args, **kwargs):
 
         try:
-            assert BookIO.select().count() == PageCount.select().count()
+            assert not has_missing_records(PageCount)
         except:
             logger.error("Page count data is not available.")
             exit(1)
@@ -30,12 +63,12 @@ def needs_text_analysis_data(func):
     Decorator conditioning the execution of a function to:
     - The presence of text analysis data in the database.
     """
-    from models import BookIO, TextAnalysis
+    from models import TextAnalysis
 
     def wrapper(*args, **kwargs):
 
         try:
-            assert BookIO.select().count() == TextAnalysis.select().count()
+            assert not has_missing_records(TextAnalysis)
         except:
             logger.error("Text analysis data is not available.")
             exit(1)
@@ -50,12 +83,12 @@ def needs_main_language_data(func):
     Decorator conditioning the execution of a function to:
     - The presence of main language data in the database.
     """
-    from models import BookIO, MainLanguage
+    from models import MainLanguage
 
     def wrapper(*args, **kwargs):
 
         try:
-            assert BookIO.select().count() == MainLanguage.select().count()
+            assert not has_missing_records(MainLanguage)
         except:
             logger.error("This command needs main language data.")
             exit(1)
@@ -70,23 +103,20 @@ def needs_language_detection_data(func):
     Decorator conditioning the execution of a function to:
     - The presence of language detection data in the database.
     """
-    from models import BookIO, MainLanguage, LanguageDetection
+    from models import MainLanguage, LanguageDetection
 
     def wrapper(*args, **kwargs):
 
         try:
-            assert BookIO.select().count() == MainLanguage.select().count()
+            assert not has_missing_records(MainLanguage)
 
-            count = (
+            assert (
                 MainLanguage.select()
                 .where(MainLanguage.from_detection_iso639_3.is_null(False))
-                .count()
+                .exists()
             )
-            assert count
 
-            count = None
-            count = LanguageDetection.select().count()
-            assert count
+            assert LanguageDetection.select().exists()
         except:
             logger.error("This command needs language detection data.")
             exit(1)
@@ -101,12 +131,12 @@ def needs_ocr_quality_data(func):
     Decorator conditioning the execution of a function to:
     - The presence of OCR quality data in the database.
     """
-    from models import BookIO, OCRQuality
+    from models import OCRQuality
 
     def wrapper(*args, **kwargs):
 
         try:
-            assert BookIO.select().count() == OCRQuality.select().count()
+            assert not has_missing_records(OCRQuality)
         except:
             logger.error("This command needs OCR quality data.")
             exit(1)
@@ -121,12 +151,12 @@ def needs_scanned_text_simhash_data(func):
     Decorator conditioning the execution of a function to:
     - The presence of scanned text simhash data in the database.
     """
-    from models import BookIO, ScannedTextSimhash
+    from models import ScannedTextSimhash
 
     def wrapper(*args, **kwargs):
 
         try:
-            assert BookIO.select().count() == ScannedTextSimhash.select().count()
+            assert not has_missing_records(ScannedTextSimhash)
         except:
             logger.error("This command needs scanned text simhash data.")
             exit(1)
@@ -183,105 +213,103 @@ def needs_everything(func):
 
     def wrapper(*args, **kwargs):
 
-        book_count = BookIO.select().count()
-
-        if not book_count:
+        if not BookIO.select().exists():
             logger.error("No books available.")
             exit(1)
 
         # Database records check
         try:
-            assert book_count == GenreClassification.select().count()
+            assert not has_missing_records(GenreClassification)
         except:
             logger.error("Genre classification data is missing.")
             exit(1)
 
         try:
-            assert book_count == HathitrustRightsDetermination.select().count()
+            assert not has_missing_records(HathitrustRightsDetermination)
         except:
             logger.error("Hathitrust rights determination data is missing.")
             exit(1)
 
         try:
-            assert book_count == MainLanguage.select().count()
+            assert not has_missing_records(MainLanguage)
             assert (
                 MainLanguage.select()
                 .where(MainLanguage.from_detection_iso639_3.is_null(False))
-                .count()
+                .exists()
             )
         except:
             logger.error("Main language data is missing.")
             exit(1)
 
         try:
-            assert LanguageDetection.select().count() > book_count
+            assert has_more_records_than_books(LanguageDetection)
         except:
             logger.error("Language detection data is missing.")
             exit(1)
 
         try:
-            assert OCRPostprocessingTrainingDataset.select().count()
+            assert OCRPostprocessingTrainingDataset.select().exists()
         except:
             logger.error("OCR Post processing dataset data is missing.")
             exit(1)
 
         try:
-            assert book_count == OCRQuality.select().count()
-            assert OCRQuality.select().where(OCRQuality.from_metadata.is_null(False)).count()
-            assert OCRQuality.select().where(OCRQuality.from_detection.is_null(False)).count()
+            assert not has_missing_records(OCRQuality)
+            assert OCRQuality.select().where(OCRQuality.from_metadata.is_null(False)).exists()
+            assert OCRQuality.select().where(OCRQuality.from_detection.is_null(False)).exists()
         except:
             logger.error("OCR quality data is missing.")
             exit(1)
 
         try:
-            assert book_count == PageCount.select().count()
-            assert PageCount.select().where(PageCount.count_from_ocr.is_null(False)).count()
+            assert not has_missing_records(PageCount)
+            assert PageCount.select().where(PageCount.count_from_ocr.is_null(False)).exists()
         except:
             logger.error("Page count data is missing.")
             exit(1)
 
         try:
-            assert book_count == ScannedTextSimhash.select().count()
+            assert not has_missing_records(ScannedTextSimhash)
         except:
             logger.error("Scanned text simhash data is missing.")
             exit(1)
 
         try:
-            assert book_count == TextAnalysis.select().count()
+            assert not has_missing_records(TextAnalysis)
         except:
             logger.error("Text analysis data is missing.")
             exit(1)
 
         try:
-            assert TokenCount.select().count() > book_count
+            assert has_more_records_than_books(TokenCount)
         except:
             logger.error("Token count data is missing.")
             exit(1)
 
         try:
-            assert TopicClassificationTrainingDataset.select().count()
+            assert TopicClassificationTrainingDataset.select().exists()
         except:
             logger.error("Topic classification training dataset data is missing.")
             exit(1)
 
         try:
-            assert book_count == TopicClassification.select().count()
+            assert not has_missing_records(TopicClassification)
             assert (
                 TopicClassification.select()
                 .where(TopicClassification.from_detection.is_null(False))
-                .count()
+                .exists()
             )
             assert (
                 TopicClassification.select()
                 .where(TopicClassification.from_metadata.is_null(False))
-                .count()
+                .exists()
             )
         except:
             logger.error("Topic classification data is missing.")
             exit(1)
 
         try:
-            assert book_count == YearOfPublication.select().count()
+            assert not has_missing_records(YearOfPublication)
         except:
             logger.error("Year of publication data is missing.")
             exit(1)
@@ -0,0 +1,38 @@
+from typing import Iterable, Iterator
+from itertools import islice
+
+import peewee
+
+
+def flag_existing_records(
+    books: Iterable,
+    model: peewee.Model,
+    batch_size: int = 999,
+    condition: peewee.Expression | None = None,
+) -> Iterator[tuple]:
+    """
+    Pairs each book from `books` with a boolean indicating whether `model` already has a record for it.
+
+    Notes:
+    - `model` is expected to have a `book` foreign key pointing to `BookIO.barcode`.
+    - Existence is resolved with one `WHERE book IN (...)` query per group of `batch_size` books, instead of one query per book.
+    - `batch_size` defaults to 999 to stay under SQLite's max number of host parameters on older builds.
+    - `condition` can be used to narrow down which records count as existing (e.g: `TokenCount.tokenizer == "o200k_base"`).
+    """
+    books = iter(books)
+
+    while True:
+        batch = list(islice(books, batch_size))
+
+        if not batch:
+            return
+
+        query = model.select(model.book).where(model.book.in_([book.barcode for book in batch]))
+
+        if condition is not None:
+            query = query.where(condition)
+
+        existing = {barcode for (barcode,) in query.tuples()}
+
+        for book in batch:
+            yield (book, book.barcode in existing)
@@ -5,11 +5,23 @@ import peewee
 
 from const import DATABASE_DIR_PATH, DATABASE_FILENAME
 
+DATABASE = None
+""" Process-level cache for the database instance. See `get_db()`. """
+
 
 def get_db() -> peewee.SqliteDatabase:
     """
     Creates and returns a connection to the local SQLite database.
+
+    Notes:
+    - The database instance is created once per process and shared by all models.
+      Peewee keeps one open connection per thread on that instance, which is reused across queries and write batches.
     """
+    global DATABASE
+
+    if DATABASE is not None:
+        return DATABASE
+
     os.makedirs(DATABASE_DIR_PATH, exist_ok=True)
     db_filepath = Path(DATABASE_DIR_PATH, DATABASE_FILENAME)
 
@@ -32,4 +44,5 @@ def get_db() -> peewee.SqliteDatabase:
     except AssertionError:
         raise ConnectionError(f"Could not connect to {db_filepath}.")
 
-    return db
+    DATABASE = db
+    return DATABASE
@@ -35,24 +35,23 @@ def get_filtered_duplicates(max_workers: int = multiprocessing.cpu_count(), pd_o
         .having(peewee.fn.COUNT(ScannedTextSimhash.hash) > 1)
     )
 
-    for entry in (
-        ScannedTextSimhash.select()
+    # NOTE: Books are joined in and selected along with their simhash, instead of being fetched one by one.
+    books = (
+        BookIO.select(BookIO, ScannedTextSimhash.hash)
+        .join(ScannedTextSimhash, on=(ScannedTextSimhash.book == BookIO.barcode))
         .where(ScannedTextSimhash.hash.in_(hash_group_subquery))
-        .iterator()
-    ):
-        hash = entry.hash
-        book = entry.book
+    )
 
-        if pd_only and not utils.is_pd(book):
-            continue
+    # Filter out non-PD books in SQL when possible
+    if pd_only:
+        books, is_filtered = utils.select_pd_books(books)
+        pd_only = not is_filtered
 
-        if hash is None:
+    for book in books.objects().iterator():
+        if pd_only and not utils.is_pd(book):
             continue
 
-        if hashes_to_books.get(hash, None) is None:
-            hashes_to_books[hash] = []
-
-        hashes_to_books[hash].append(book)
+        hashes_to_books.setdefault(book.hash, []).append(book)
 
     #
     # For each group, filter and eliminate false positives
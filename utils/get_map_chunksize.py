@@ -0,0 +1,17 @@
+import multiprocessing
+
+
+def get_map_chunksize(items_count: int, max_workers=1) -> int:
+    """
+    Returns a "likely reasonable" `chunksize` for `ProcessPoolExecutor.map()` based on:
+    - The number of items to process
+    - The number of workers available
+
+    Aims for roughly 4 chunks per worker, so the pool amortizes pickling / IPC overhead while keeping workers busy until the end of the run.
+
+    If `max_workers` is not provided, it defaults to the number of available threads.
+    """
+    if max_workers < 1:
+        max_workers = multiprocessing.cpu_count()
+
+    return max(1, items_count // (max_workers * 4))
@@ -1,5 +1,13 @@
+from functools import lru_cache
+
 import iso639
 
+TITLE_METADATA_KEYS = ("MARC Title", "MARC Title Remainder")
+""" `books_latest.csv` fields making up a book's title, in order. """
+
+AUTHOR_METADATA_KEYS = ("MARC Author Personal", "MARC Author Corporate", "MARC Author Meeting")
+""" `books_latest.csv` fields making up a book's author, in order. """
+
 
 def get_metadata_as_text_prompt(
     book,
@@ -16,37 +24,27 @@ def get_metadata_as_text_prompt(
     """
     from models import BookIO
 
-    prompt = ""
+    # NOTE: Metadata is resolved once, and the prompt is assembled from a list of lines.
+    metadata = book.metadata
+    prompt = []
 
     # Title
-    title = ""
-
-    for gxml_key in ["MARC Title", "MARC Title Remainder"]:
-        title += book.metadata.get(gxml_key, "")
-        title += " "
+    title = " ".join(metadata.get(key, "") for key in TITLE_METADATA_KEYS) + " "
 
     if title.strip():
-        prompt += f"Title: {title}\n"
+        prompt.append(f"Title: {title}\n")
 
     # Author
-    author = ""
-
-    for gxml_key in [
-        "MARC Author Personal",
-        "MARC Author Corporate",
-        "MARC Author Meeting",
-    ]:
-        author += book.metadata.get(gxml_key, "")
-        author += " "
+    author = " ".join(metadata.get(key, "") for key in AUTHOR_METADATA_KEYS) + " "
 
     if author.strip():
-        prompt += f"Author: {author}\n"
+        prompt.append(f"Author: {author}\n")
 
     # Year
     try:
         year_of_publication = book.yearofpublication_set[0].year
         assert year_of_publication
-        prompt += f"Year: {year_of_publication}\n"
+        prompt.append(f"Year: {year_of_publication}\n")
     except Exception:
         pass
 
@@ -55,8 +53,8 @@ def get_metadata_as_text_prompt(
         main_language = book.mainlanguage_set[0].from_detection_iso639_3
         assert main_language
 
-        main_language = iso639.Lang(pt3=main_language).name
-        prompt += f"Language: {main_language}\n"
+        main_language = get_language_name(main_language)
+        prompt.append(f"Language: {main_language}\n")
     except Exception:
         pass
 
@@ -65,7 +63,7 @@ def get_metadata_as_text_prompt(
         try:
             topic = book.topicclassification_set[0].from_metadata
             assert topic
-            prompt += f"Subject/Topic: {topic}\n"
+            prompt.append(f"Subject/Topic: {topic}\n")
         except Exception:
             pass
 
@@ -74,18 +72,29 @@ def get_metadata_as_text_prompt(
         try:
             genre = book.genreclassification_set[0].from_metadata
             assert genre
-            prompt += f"Genre/Form: {genre}\n"
+            prompt.append(f"Genre/Form: {genre}\n")
         except Exception:
             pass
 
     # General note
-    general_note = book.metadata.get("MARC General Note", None)
+    general_note = metadata.get("MARC General Note", None)
 
     if general_note:
-        prompt += f"General note: {general_note}"
+        prompt.append(f"General note: {general_note}")
+
+    prompt = "".join(prompt)
 
     # Throw if no metadata was available
     if not prompt.strip():
         raise Exception("No metadata available.")
 
     return prompt
+
+
+@lru_cache(maxsize=None)
+def get_language_name(iso639_3: str) -> str:
+    """
+    Returns the name of the language matching a given ISO 639-3 code.
+    Memoized, since the same handful of codes come up for most books.
+    """
+    return iso639.Lang(pt3=iso639_3).name
@@ -1,4 +1,5 @@
 import re
+from typing import Iterator
 
 from const import DEFAULT_SIMHASH_SHINGLE_WIDTH
 
@@ -6,11 +7,14 @@ from const import DEFAULT_SIMHASH_SHINGLE_WIDTH
 def get_simhash_shingles(
     text: str,
     shingle_width: int = DEFAULT_SIMHASH_SHINGLE_WIDTH,
-) -> list:
+) -> Iterator[str]:
     """
-    Processes a string into a list of shingles for use with Simhash.
+    Processes a string into shingles for use with Simhash.
+    Shingles are yielded one at a time, so the full list never needs to be held in memory.
     via: https://leons.im/posts/a-python-implementation-of-simhash-algorithm/
     """
     text = text.lower()
     text = re.sub(r"[^\w]+", "", text)
-    return [text[i : i + shingle_width] for i in range(max(len(text) - shingle_width + 1, 1))]
+
+    for i in range(max(len(text) - shingle_width + 1, 1)):
+        yield text[i : i + shingle_width]
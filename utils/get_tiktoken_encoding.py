@@ -0,0 +1,14 @@
+from functools import lru_cache
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_tiktoken_encoding(encoding_name: str) -> tiktoken.Encoding:
+    """
+    Returns the tiktoken encoding `encoding_name`, loading it only once per process.
+
+    Notes:
+    - Can be used as a `ProcessPoolExecutor` initializer (with `initargs=(encoding_name,)`) so each worker loads it upfront.
+    """
+    return tiktoken.get_encoding(encoding_name)
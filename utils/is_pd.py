@@ -49,3 +49,28 @@ def is_pd(book) -> bool:
         )
 
     return result
+
+
+def select_pd_books(query):
+    """
+    Narrows down a `BookIO` select query to books that are likely in the public domain, when that can be determined in SQL.
+    Returns a `(query, is_filtered)` tuple: if `is_filtered` is `False`, `is_pd()` still needs to be called on each book.
+
+    Notes:
+    - Only applies to the `HATHITRUST` mechanism: rights determination records are joined in, instead of being fetched for each book.
+    - The `LIST` mechanism is already a set lookup in `is_pd()`.
+    """
+    from models import BookIO, HathitrustRightsDetermination
+
+    if os.getenv("PD_FILTERING_MECHANISM", None) != "HATHITRUST":
+        return (query, False)
+
+    query = query.join(
+        HathitrustRightsDetermination,
+        on=(HathitrustRightsDetermination.book == BookIO.barcode),
+    ).where(
+        HathitrustRightsDetermination.rights_code.in_(HATHITRUST_PD_CODES),
+        HathitrustRightsDetermination.us_rights_string == HATHITRUST_PD_STRING,
+    )
+
+    return (query, True)
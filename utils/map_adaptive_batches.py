@@ -0,0 +1,81 @@
+import time
+from typing import Callable, Iterable, Iterator
+from itertools import islice
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+
+
+def map_adaptive_batches(
+    executor: Executor,
+    func: Callable,
+    items: Iterable,
+    max_workers: int = 1,
+    target_batch_duration: float = 5.0,
+    initial_batch_size: int = 16,
+    min_batch_size: int = 1,
+    max_batch_size: int = 10_000,
+    items_count: int | None = None,
+) -> Iterator:
+    """
+    Sends `items` to `executor` in batches, calling `func(batch)` for each of them.
+    Yields the return value of each call, in order of completion.
+
+    The size of the next batch is adjusted every time a batch completes, based on how long it took to process, so batches take roughly `target_batch_duration` seconds.
+    Inspired by joblib's dynamic batch sizing.
+
+    Notes:
+    - Only `max_workers * 2` batches are in flight at once: `items` is consumed as batches complete, instead of being split into batches upfront.
+    - Batch size can at most double or halve compared to the batch that just completed, to avoid overreacting to a single outlier.
+    - If `items_count` is provided, batches are capped at `items_count // max_workers` items, so a single batch can't take over the tail of a small selection.
+    - Exceptions raised by `func` are re-raised when the corresponding batch is collected.
+    """
+    items = iter(items)
+
+    if items_count is not None:
+        max_batch_size = min(
+            max_batch_size, max(min_batch_size, items_count // max(max_workers, 1))
+        )
+
+    batch_size = min(max(min_batch_size, initial_batch_size), max_batch_size)
+    in_flight = set()
+
+    def submit_batch() -> bool:
+        batch = list(islice(items, batch_size))
+
+        if not batch:
+            return False
+
+        in_flight.add(executor.submit(call_timed, func, batch))
+        return True
+
+    # Fill the initial window
+    for _ in range(max(max_workers, 1) * 2):
+        if not submit_batch():
+            break
+
+    # Collect batches as they complete, resize and submit the next ones
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            in_flight.remove(future)
+            result, batch_length, duration = future.result()
+
+            ideal_batch_size = int(batch_length * target_batch_duration / max(duration, 0.001))
+            # NOTE: Bounds are derived from the completed batch rather than from the current `batch_size`,
+            # so batches completing within the same window don't compound each other's growth.
+            batch_size = min(max(ideal_batch_size, batch_length // 2), batch_length * 2)
+            batch_size = min(max(batch_size, min_batch_size), max_batch_size)
+
+            yield result
+
+            submit_batch()
+
+
+def call_timed(func: Callable, batch: list) -> tuple:
+    """
+    Runs `func(batch)` and returns a `(result, batch_length, duration)` tuple.
+    Defined at module level so it can be sent to a ProcessPoolExecutor.
+    """
+    start = time.perf_counter()
+    result = func(batch)
+    return (result, len(batch), time.perf_counter() - start)
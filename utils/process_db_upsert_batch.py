@@ -0,0 +1,48 @@
+import peewee
+
+
+def process_db_upsert_batch(
+    model: peewee.Model,
+    entries: list[peewee.Model],
+    fields_to_update: list[peewee.Field],
+    conflict_target: list[peewee.Field] | None = None,
+) -> bool:
+    """
+    Processes a batch of database "upsert" operations:
+    - Entries that don't exist yet are created.
+    - Entries that already exist have their `fields_to_update` overwritten. Other columns are left untouched.
+
+    Notes:
+    - Runs as `INSERT ... ON CONFLICT DO UPDATE` statements, in a single transaction.
+    - `conflict_target` defaults to `[model.book]`.
+    - `entries` is emptied in place.
+    """
+    if not entries:
+        return True
+
+    if conflict_target is None:
+        conflict_target = [model.book]
+
+    conflict_target_names = [field.name for field in conflict_target]
+
+    columns = conflict_target + [
+        field for field in fields_to_update if field.name not in conflict_target_names
+    ]
+
+    rows = [tuple(entry.__data__.get(field.name) for field in columns) for entry in entries]
+
+    # Calculates the optimal size for SQLite based on max variable number
+    # https://www.sqlite.org/limits.html#max_variable_number
+    sqlite_batch_size = (32766 / 2) // len(columns)
+    sqlite_batch_size = int(sqlite_batch_size)
+
+    with model._meta.database.atomic():
+        for batch in peewee.chunked(rows, sqlite_batch_size):
+            model.insert_many(batch, fields=columns).on_conflict(
+                conflict_target=conflict_target,
+                preserve=fields_to_update,
+            ).execute()
+
+    entries.clear()
+
+    return True